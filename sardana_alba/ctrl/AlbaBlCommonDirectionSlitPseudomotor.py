@@ -1,8 +1,10 @@
 from sardana.pool.controller import PseudoMotorController, Description, \
     Type, DefaultValue
 
+from sardana_alba.ctrl.util.trajectory import TrajectoryMixin
 
-class CommonDirectionSlit(PseudoMotorController):
+
+class CommonDirectionSlit(TrajectoryMixin, PseudoMotorController):
     """A Slit pseudo motor controller for handling gap and offset pseudo
        motors. The system uses to real motors sl2t (top slit) and sl2b (bottom
        slit)."""
@@ -52,3 +54,10 @@ class CommonDirectionSlit(PseudoMotorController):
         half_gap = pseudo_pos[0] / 2.0
         return (self.sign * (pseudo_pos[1] + half_gap),
                 self.sign * (pseudo_pos[1] - half_gap))
+
+    def _calc_all_physical_batch(self, pseudos, curr_physicals):
+        # plain arithmetic, the scalar formulas work on arrays as well
+        return self.CalcAllPhysical(pseudos, curr_physicals)
+
+    def _calc_all_pseudo_batch(self, physicals, curr_pseudos):
+        return self.CalcAllPseudo(physicals, curr_pseudos)
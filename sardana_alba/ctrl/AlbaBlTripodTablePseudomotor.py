@@ -1,6 +1,11 @@
 import math
+import numpy
 import PyTango
-from sardana.pool.controller import PseudoMotorController, Description, Type
+from sardana.pool.controller import PseudoMotorController, Description, \
+    Type, DefaultValue
+
+from sardana_alba.ctrl.util.trajectory import TrajectoryMixin, \
+    jacobian_from_rows
 
 
 def rotate_x(y, z, cosangle, sinangle):
@@ -42,7 +47,7 @@ def rotate_z(x, y, cosangle, sinangle):
     return cosangle * x - sinangle * y, sinangle * x + cosangle * y
 
 
-class TripodTableController(PseudoMotorController):
+class TripodTableController(TrajectoryMixin, PseudoMotorController):
     """
     This is a pseudomotor controller for a three-legs table.
     It expects three physical motors: jack1, jack2, jack3 and provides 3
@@ -54,6 +59,10 @@ class TripodTableController(PseudoMotorController):
     comma separated float values representing x,y,z coordinates in global
     coordinate system e.g. "3123.09, -3232.33, 1400"):
       Jack1Coordinates, Jack2Coordinates, Jack3Coordinates, CenterCoordinates
+
+    The closed-form CalcAllPhysical is not the exact inverse of
+    CalcAllPseudo for combined pitch and roll. Set NumericalInverse to
+    refine its result with the Newton solver of TrajectoryMixin.
     """
 
     pseudo_motor_roles = ('z', 'pitch', 'roll')
@@ -69,7 +78,12 @@ class TripodTableController(PseudoMotorController):
         'CenterCoordinates': {Type: str,
                               Description: 'center coordination: x,y,z'},
         'CrossedPMLimitsCheck': {Type: bool,
-                                 Description: 'checks the crossed PM limits'}
+                                 Description: 'checks the crossed PM limits'},
+        'NumericalInverse': {Type: bool,
+                             Description: 'refine the physical positions '
+                                          'with the numerical inverse of '
+                                          'the pseudo positions calculation',
+                             DefaultValue: False}
     }
 
     # This is azimuth angle for BL22-CLAESS (Synchrotron ALBA) which is 45
@@ -91,6 +105,7 @@ class TripodTableController(PseudoMotorController):
             center_coord = props['CenterCoordinates'].split(',')
             self.center = [float(c) for c in center_coord]
             self.check_limits = props['CrossedPMLimitsCheck']
+            self.numerical_inverse = props.get('NumericalInverse', False)
             self._log.debug("check limits value: %s" % self.check_limits)
 
             if len(self.jack1) != 3 or \
@@ -183,6 +198,10 @@ class TripodTableController(PseudoMotorController):
         jack1 = jack1_local + z  # + self.zOffset
         jack2 = jack2_local + z  # + self.zOffset
         jack3 = jack3_local + z  # + self.zOffset
+        if self.numerical_inverse:
+            self._log.debug("Refining with the numerical inverse")
+            jack1, jack2, jack3 = self._solve_physical(
+                numpy.asarray(pseudo_pos, dtype=float), [jack1, jack2, jack3])
         self._log.debug("Leaving calc_all_physical")
         return jack1, jack2, jack3
 
@@ -230,6 +249,56 @@ class TripodTableController(PseudoMotorController):
         self._log.debug("Leaving calc_all_pseudo")
         return z, pitch, roll
 
+    def _calc_all_physical_batch(self, pseudos, curr_physical_pos):
+        # same geometry as CalcAllPhysical, evaluated on arrays. The crossed
+        # limits check is not done: it validates the current positions,
+        # not the planned ones
+        z, pitch, roll = pseudos
+        pitch = pitch / 1000
+        roll = roll / 1000
+        A, C = rotate_y(0.0, 1.0, numpy.cos(roll), numpy.sin(roll))
+        B, C = rotate_x(0.0, C, numpy.cos(pitch), numpy.sin(pitch))
+        return [(-A * jl[0] - B * jl[1]) / C + z
+                for jl in (self.jack1local, self.jack2local, self.jack3local)]
+
+    def _calc_all_pseudo_batch(self, physicals, curr_pseudo_pos):
+        # same geometry as CalcAllPseudo, evaluated on arrays
+        jack1, jack2, jack3 = physicals
+        A = (self.jack2[1] - self.jack1[1]) * (jack3 - jack1) \
+            - (self.jack3[1] - self.jack1[1]) * (jack2 - jack1)
+        B = (self.jack3[0] - self.jack1[0]) * (jack2 - jack1) \
+            - (self.jack2[0] - self.jack1[0]) * (jack3 - jack1)
+        C = (self.jack2[0] - self.jack1[0]) * (self.jack3[1] - self.jack1[1]) \
+            - (self.jack3[0] - self.jack1[0]) * (self.jack2[1] - self.jack1[1])
+        ABCNorm = numpy.sqrt(A ** 2 + B ** 2 + C ** 2)
+        if C < 0:
+            ABCNorm *= -1  # its normal looks upwards!
+        A = A / ABCNorm
+        B = B / ABCNorm
+        C = C / ABCNorm
+        D = A * self.jack1[0] + B * self.jack1[1] + C * jack1
+        z = (D - A * self.center[0] - B * self.center[1]) / C
+        locA, locB = rotate_z(A, B, self.cosAzimuth, self.sinAzimuth)
+        roll = numpy.arctan(locA / C)
+        pitch = numpy.arctan(
+            -locB / (locA * numpy.sin(roll) + C * numpy.cos(roll)))
+        return z, pitch * 1000, roll * 1000
+
+    def _calc_physical_jacobian_batch(self, pseudos):
+        # jack = z - x * tan(roll) / cos(pitch) + y * tan(pitch), where x and
+        # y are the local jack coordinates and the angles are in mrad
+        z, pitch, roll = pseudos
+        pitch = pitch / 1000
+        roll = roll / 1000
+        cosPitch = numpy.cos(pitch)
+        tanRoll = numpy.tan(roll)
+        rows = []
+        for jl in (self.jack1local, self.jack2local, self.jack3local):
+            dpitch = (jl[1] - jl[0] * tanRoll * numpy.sin(pitch)) / cosPitch ** 2
+            droll = -jl[0] / (numpy.cos(roll) ** 2 * cosPitch)
+            rows.append([1.0, dpitch / 1000, droll / 1000])
+        return jacobian_from_rows(rows, len(z))
+
     def _validateCurrentPositions(self):
         self._checkPseudoMotorLimits()
         try:
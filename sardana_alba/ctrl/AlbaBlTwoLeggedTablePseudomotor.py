@@ -1,19 +1,23 @@
-import math
+import numpy
 
 from sardana.pool.controller import (
     PseudoMotorController, Type, Description, DefaultValue)
 
+from sardana_alba.ctrl.util.trajectory import TrajectoryMixin, \
+    jacobian_from_rows
+
 
 class TwoLeggedTable:
     """ This formulas units are: 'm' for distances and 'rad' for angles.
         This is a generic 'two legged table' class which is able to
         translate from two phyisical translation actuators to the pseudo
         common translation and rotation in a given pivoting point.
+        Positions may be floats or numpy arrays.
     """
 
     def get_trans(self, dist, pos, rot):
         """ Get motor translation"""
-        return pos + (dist * math.tan(rot))
+        return pos + (dist * numpy.tan(rot))
 
     def get_pos(self, dist_1, dist_2, trans_1, trans_2):
         """ Get table position"""
@@ -21,10 +25,11 @@ class TwoLeggedTable:
 
     def get_rot(self, dist_1, dist_2, trans_1, trans_2):
         """ Get table rotation """
-        return math.atan2((trans_2 - trans_1), (dist_2 - dist_1))
+        return numpy.arctan2((trans_2 - trans_1), (dist_2 - dist_1))
 
 
-class TwoLeggedTableController(PseudoMotorController, TwoLeggedTable):
+class TwoLeggedTableController(TrajectoryMixin, PseudoMotorController,
+                               TwoLeggedTable):
     """ PseudoMotor controller for Two legged table's position and rotation.
 
     Assuming an XYZ right handed coordinate system:
@@ -87,6 +92,26 @@ class TwoLeggedTableController(PseudoMotorController, TwoLeggedTable):
 
         return (pos, rot * 1000)
 
+    def _calc_all_physical_batch(self, pseudos, curr_physicals):
+        return self.CalcAllPhysical(pseudos, curr_physicals)
+
+    def _calc_all_pseudo_batch(self, physicals, curr_pseudos):
+        return self.CalcAllPseudo(physicals, curr_pseudos)
+
+    def _calc_physical_jacobian_batch(self, pseudos):
+        pos, rot = pseudos
+        # d tan(x) / dx = 1 / cos(x)^2 and rot is in mrad
+        dtan = 1 / (1000.0 * numpy.cos(rot / 1000.0) ** 2)
+        return jacobian_from_rows([[1.0, self.dist1 * dtan],
+                                   [1.0, self.dist2 * dtan]], len(pos))
+
+    def _calc_pseudo_jacobian_batch(self, physicals):
+        trans1, trans2 = physicals
+        length = self.dist2 - self.dist1
+        drot = 1000.0 * length / (length ** 2 + (trans2 - trans1) ** 2)
+        return jacobian_from_rows([[self.dist2 / length, -self.dist1 / length],
+                                   [-drot, drot]], len(trans1))
+
 
 if __name__ == '__main__':
 
@@ -1,9 +1,12 @@
-import math
+import numpy
 from sardana.pool.controller import PseudoMotorController, Description, \
     DefaultValue, Type
 
+from sardana_alba.ctrl.util.trajectory import TrajectoryMixin, \
+    jacobian_from_rows
 
-class TwoXStageController(PseudoMotorController):
+
+class TwoXStageController(TrajectoryMixin, PseudoMotorController):
     """
     This is a pseudomotor controller for a stage with two lateral translation
     motors. It expects two physical motors: mx1, mx2 and provides 2
@@ -62,7 +65,7 @@ class TwoXStageController(PseudoMotorController):
 
     def CalcAllPhysical(self, pseudo_pos, curr_physical_pos):
         x, yaw = pseudo_pos
-        tanYaw = math.tan(yaw/1000)  # converts back to radians
+        tanYaw = numpy.tan(yaw/1000)  # converts back to radians
         tx1 = -tanYaw * self.tx1[1] + x
         tx2 = -tanYaw * self.tx2[1] + x
         return tx1, tx2
@@ -70,6 +73,27 @@ class TwoXStageController(PseudoMotorController):
     def CalcAllPseudo(self, physical_pos, curr_pseudo_pos):
         tx1, tx2 = physical_pos
         x = tx1 - (tx2 - tx1) * self.tx1[1] / (self.tx2[1] - self.tx1[1])
-        yaw = -math.atan((tx2 - tx1) / (self.tx2[1] - self.tx1[1]))
+        yaw = -numpy.arctan((tx2 - tx1) / (self.tx2[1] - self.tx1[1]))
         yaw *= 1000  # conversion to mrad
         return x, yaw
+
+    def _calc_all_physical_batch(self, pseudos, curr_physical_pos):
+        # the formulas are evaluated with numpy, they work on arrays as well
+        return self.CalcAllPhysical(pseudos, curr_physical_pos)
+
+    def _calc_all_pseudo_batch(self, physicals, curr_pseudo_pos):
+        return self.CalcAllPseudo(physicals, curr_pseudo_pos)
+
+    def _calc_physical_jacobian_batch(self, pseudos):
+        x, yaw = pseudos
+        # d tan(x) / dx = 1 / cos(x)^2 and yaw is in mrad
+        dtan = 1 / (1000.0 * numpy.cos(yaw / 1000) ** 2)
+        return jacobian_from_rows([[1.0, -self.tx1[1] * dtan],
+                                   [1.0, -self.tx2[1] * dtan]], len(x))
+
+    def _calc_pseudo_jacobian_batch(self, physicals):
+        tx1, tx2 = physicals
+        length = self.tx2[1] - self.tx1[1]
+        dyaw = 1000.0 * length / (length ** 2 + (tx2 - tx1) ** 2)
+        return jacobian_from_rows([[self.tx2[1] / length, -self.tx1[1] / length],
+                                   [dyaw, -dyaw]], len(tx1))
@@ -1,6 +1,10 @@
+import functools
+import threading
+import time
+
 import tango
 from sardana.pool.controller import IORegisterController, Type, Description, \
-    Access, DataAccess
+    Access, DataAccess, DefaultValue
 from sardana import State
 from sardana.tango.core.util import from_tango_state_to_state
 
@@ -35,7 +39,17 @@ class FeIORController(IORegisterController):
         'IsFeControlDisabledAttribute': {
             Type: str,
             Description: 'Name of the tango attribute which indicates if '
-                         'control of the fe is disabled'}
+                         'control of the fe is disabled'},
+        'CacheTime': {
+            Type: float,
+            Description: 'Time in seconds during which the values read from '
+                         'the EPS device are reused',
+            DefaultValue: 0.1},
+        'UseEvents': {
+            Type: bool,
+            Description: 'Keep the EPS values up to date with change events '
+                         'instead of reading them',
+            DefaultValue: False}
     }
 
     axis_attributes = {
@@ -47,11 +61,74 @@ class FeIORController(IORegisterController):
     MaxDevice = 1
 
     def __init__(self, inst, props, *args, **kwargs):
+        # before anything which can fail, __del__ needs them
+        self._event_ids = []
+        self._event_values = {}
+        self._lock = threading.Lock()
         IORegisterController.__init__(self, inst, props, *args, **kwargs)
         if len(self.EpsDevice.split('/')) != 3:
             raise Exception('EpsDevice property is not properly set.')
         self.epsDevice = tango.DeviceProxy(self.EpsDevice)
-        
+        self._attr_names = ['State',
+                            self.IsFeControlDisabledAttribute,
+                            self.IsFeFirstValveClosedAttribute,
+                            self.IsFeInterlockedAttribute,
+                            self.IsFeOpenedAttribute]
+        # values read with read_attributes, kept CacheTime seconds
+        self._read_values = {}
+        self._read_time = 0
+        if self.UseEvents:
+            self._subscribe()
+
+    def __del__(self):
+        self._unsubscribe()
+
+    def _subscribe(self):
+        try:
+            for name in self._attr_names:
+                event_id = self.epsDevice.subscribe_event(
+                    name, tango.EventType.CHANGE_EVENT,
+                    functools.partial(self._attribute_changed, name))
+                self._event_ids.append(event_id)
+        except Exception as e:
+            self._log.warning('Could not subscribe to the EPS change events, '
+                              'the attributes will be read: %s' % e)
+            self._unsubscribe()
+
+    def _unsubscribe(self):
+        while self._event_ids:
+            try:
+                self.epsDevice.unsubscribe_event(self._event_ids.pop())
+            except Exception:
+                pass
+        with self._lock:
+            self._event_values = {}
+
+    def _attribute_changed(self, name, event):
+        with self._lock:
+            if event.err or event.attr_value is None:
+                self._event_values.pop(name, None)
+            else:
+                self._event_values[name] = event.attr_value.value
+
+    def _read_eps(self):
+        """Return the values of all the EPS attributes used by the
+        controller. They come from the change events if all of them are up
+        to date, otherwise from the cache or from a single read_attributes
+        call. The returned dictionary is a copy."""
+        if self._event_ids:
+            with self._lock:
+                if len(self._event_values) == len(self._attr_names):
+                    return dict(self._event_values)
+        now = time.time()
+        if now - self._read_time > self.CacheTime:
+            attrs = self.epsDevice.read_attributes(self._attr_names)
+            self._read_values = {
+                name: attr.value
+                for name, attr in zip(self._attr_names, attrs)}
+            self._read_time = now
+        return dict(self._read_values)
+
     def AddDevice(self, axis):
         pass
         
@@ -60,7 +137,11 @@ class FeIORController(IORegisterController):
 
     def StateOne(self, axis):
         try:
-            state = from_tango_state_to_state(self.epsDevice.state())
+            values = self._read_eps()
+            state = from_tango_state_to_state(values['State'])
+            isFeControlDisabled = values[self.IsFeControlDisabledAttribute]
+            isFeFirstValveClosed = values[self.IsFeFirstValveClosedAttribute]
+            isFeInterlocked = values[self.IsFeInterlockedAttribute]
         except Exception as e:
             state = State.Alarm
             status = 'Verifying state of eps tange device thrown the ' \
@@ -68,30 +149,23 @@ class FeIORController(IORegisterController):
             return state, status
 
         status = 'The EPS device is in {}'.format(repr(state))
-        isFeControlDisabled = self.epsDevice.read_attribute(
-            self.IsFeControlDisabledAttribute).value
         if isFeControlDisabled:
             state = State.Alarm
             status += '\nControl over fe is disabled from the Control Room'
 
-        isFeFirstValveClosed = self.epsDevice.read_attribute(
-            self.IsFeFirstValveClosedAttribute).value
         if isFeFirstValveClosed:
             state = State.Alarm
             status += '\nFirst valve of the fe is closed'
 
-        isFeInterlocked = self.epsDevice.read_attribute(
-            self.IsFeInterlockedAttribute).value
         if isFeInterlocked:
             state = State.Alarm
             status += '\nfe is interlocked'
         return state, status
 
     def ReadOne(self, axis):
-        isFeOpened = self.epsDevice.read_attribute(
-            self.IsFeOpenedAttribute).value
+        isFeOpened = self._read_eps()[self.IsFeOpenedAttribute]
         return int(isFeOpened)
-        
+
     def WriteOne(self, axis, value):        
         if value == 1:
             self.epsDevice.write_attribute(self.OpenFeAttribute, True)
@@ -99,6 +173,8 @@ class FeIORController(IORegisterController):
             self.epsDevice.write_attribute(self.CloseFeAttribute, True)
         else:
             raise ValueError("This ior accepts only 0 and 1 values")
+        # the next StateOne/ReadOne must see the new value
+        self._read_time = 0
     
     def GetAxisExtraPar(self, axis, name):
         if name.lower() == 'labels':
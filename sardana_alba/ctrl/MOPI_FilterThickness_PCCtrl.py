@@ -1,9 +1,60 @@
+import numpy
+import tango
 from sardana.pool import PoolUtil
-from sardana.pool.controller import PseudoCounterController, Description, Type
+from sardana.pool.controller import PseudoCounterController, Description, \
+    Type, DefaultValue
+
+
+#  IF CHAIN FROM RT TICKET: RT#17856
+#  https://rt.cells.es/Ticket/Display.html?id=17856
+# x = mopi_lon - mopi_filt + 56.5 - 8.356
+# new definition of x: https://rt.cells.es/Ticket/Display.html?id=39823
+# x=mopi_lon - mopi_filt + 43.11
+# new definition of x: https://rt.cells.es/Ticket/Display.html?id=41227
+DEFAULT_OFFSET = 42.25
+# x > 100: 0, 90 < x <= 100: 5, 0 < x <= 90: 0.1 + 0.0544 * x, x <= 0: 0
+DEFAULT_THICKNESS_TABLE = '100, 0, 0; 90, 5, 0; 0, 0.1, 0.0544'
+
+
+def parse_thickness_table(table):
+    """Parse a piecewise linear thickness table.
+
+    :param table: (str) segments separated by ";", each of them with its
+        "lower x limit, constant, slope" (e.g. "90, 5, 0; 0, 0.1, 0.0544")
+
+    :return: (tuple<numpy.ndarray>) lower limits, constants and slopes,
+        sorted by decreasing lower limit"""
+    try:
+        segments = [[float(v) for v in segment.split(',')]
+                    for segment in table.split(';') if segment.strip()]
+        segments = numpy.array(segments, dtype=float).reshape(-1, 3)
+    except ValueError:
+        raise ValueError('ThicknessTable must be a list of "lower, constant, '
+                         'slope" segments separated by ";": %r' % table)
+    segments = segments[numpy.argsort(-segments[:, 0])]
+    return segments[:, 0], segments[:, 1], segments[:, 2]
+
+
+def calc_thickness(x, lower, constant, slope):
+    """Evaluate the piecewise linear thickness on a value or an array.
+
+    The first segment (by decreasing lower limit) with x > lower is used,
+    the thickness is 0 below all of them."""
+    x = numpy.asarray(x, dtype=float)
+    above = x[..., numpy.newaxis] > lower
+    segment = numpy.argmax(above, axis=-1)
+    thickness = numpy.where(numpy.any(above, axis=-1),
+                            constant[segment] + slope[segment] * x, 0.0)
+    if thickness.ndim == 0:
+        return float(thickness)
+    return thickness
 
 
 class MOPIFilterThicknessPCCtrl(PseudoCounterController):
-    """ The MOPI Filter Thickness Pseudo Counter Controller."""
+    """ The MOPI Filter Thickness Pseudo Counter Controller.
+
+    The motor positions are cached from their change events. If the motors
+    do not push events the positions are read on every calculation."""
 
     ctrl_properties = {
         'mopi_lon_dev': {
@@ -13,7 +64,27 @@ class MOPIFilterThicknessPCCtrl(PseudoCounterController):
         'mopi_filt_dev': {
             Description: 'The mopi filt motor used for the operations.',
             Type: str
-        }
+        },
+        'Offset': {
+            Description: 'x = mopi_lon - mopi_filt + Offset',
+            Type: float,
+            DefaultValue: DEFAULT_OFFSET
+        },
+        'ThicknessTable': {
+            Description: 'Piecewise linear thickness(x): "lower, constant, '
+                         'slope" segments separated by ";". The first '
+                         'segment with x > lower gives constant + slope * x, '
+                         'the thickness is 0 below all of them.',
+            Type: str,
+            DefaultValue: DEFAULT_THICKNESS_TABLE
+        },
+        'UseEvents': {
+            Description: 'Cache the motor positions from their change '
+                         'events instead of reading them on every '
+                         'calculation.',
+            Type: bool,
+            DefaultValue: True
+        },
     }
 
     pseudo_counter_roles = ('mopi_filter_thickness',)
@@ -30,36 +101,81 @@ class MOPIFilterThicknessPCCtrl(PseudoCounterController):
         self.inst_name = inst
         self.mopi_lon_motor = None
         self.mopi_filt_motor = None
+        self._table = parse_thickness_table(self.ThicknessTable)
+        self._positions = {}
+        self._event_ids = []
 
-    def Calc(self, index, counter_values):
-        if self.mopi_lon_motor is None or self.mopi_filt_motor is None:
+    def __del__(self):
+        for motor, event_id in self._event_ids:
             try:
-                self.mopi_lon_motor = PoolUtil.get_device(
-                    self.inst_name, self.mopi_lon_dev)
-                self.mopi_filt_motor = PoolUtil.get_device(
-                    self.inst_name, self.mopi_filt_dev)
+                motor.unsubscribe_event(event_id)
+            except Exception:
+                pass
+
+    def _connect(self):
+        try:
+            self.mopi_lon_motor = PoolUtil.get_device(
+                self.inst_name, self.mopi_lon_dev)
+            self.mopi_filt_motor = PoolUtil.get_device(
+                self.inst_name, self.mopi_filt_dev)
+        except Exception as e:
+            self._log.error('Error connecting to devices %s and/or %s: %s' %
+                            (self.mopi_lon_dev, self.mopi_filt_dev, str(e)))
+            raise
+        if not self.UseEvents:
+            return
+        for motor in (self.mopi_lon_motor, self.mopi_filt_motor):
+            try:
+                event_id = motor.subscribe_event(
+                    'Position', tango.EventType.CHANGE_EVENT,
+                    self._position_changed)
+                self._event_ids.append((motor, event_id))
             except Exception as e:
-                self._log.error('Error connecting to devices %s and/or %s: %s' %
-                                (self.mopi_lon_dev, self.mopi_filt_dev, str(e)))
-
-        mopi_lon = self.mopi_lon_motor.read_attribute('Position').value
-        mopi_filt = self.mopi_filt_motor.read_attribute('Position').value
-
-        #  IF CHAIN FROM RT TICKET: RT#17856
-        #  https://rt.cells.es/Ticket/Display.html?id=17856
-        # x = mopi_lon - mopi_filt + 56.5 - 8.356
-        # new definition of x: https://rt.cells.es/Ticket/Display.html?id=39823
-        # x=mopi_lon - mopi_filt + 43.11
-        # new definition of x: https://rt.cells.es/Ticket/Display.html?id=41227
-        x = mopi_lon - mopi_filt + 42.25
-
-        if x > 100:
-            thickness = 0
-        elif x > 90:
-            thickness = 5
-        elif x > 0:
-            thickness = 0.1 + 0.0544 * x
+                self._log.warning('Could not subscribe to %s position '
+                                  'events, it will be read on every '
+                                  'calculation: %s' % (motor.name(), e))
+
+    def _position_changed(self, event):
+        name = event.device.name().lower()
+        if event.err or event.attr_value is None:
+            self._positions.pop(name, None)
         else:
-            thickness = 0
+            self._positions[name] = event.attr_value.value
+
+    def _read_position(self, motor):
+        position = self._positions.get(motor.name().lower())
+        if position is None:
+            position = motor.read_attribute('Position').value
+        return position
+
+    def calc_thickness(self, mopi_lon, mopi_filt):
+        """Calculate the filter thickness. Positions may be floats or
+        arrays (e.g. a block of points of a continuous scan)."""
+        x = numpy.subtract(mopi_lon, mopi_filt) + self.Offset
+        return calc_thickness(x, *self._table)
+
+    def Calc(self, index, counter_values):
+        if self.mopi_lon_motor is None or self.mopi_filt_motor is None:
+            self._connect()
 
-        return thickness
+        mopi_lon = self._read_position(self.mopi_lon_motor)
+        mopi_filt = self._read_position(self.mopi_filt_motor)
+        return self.calc_thickness(mopi_lon, mopi_filt)
+
+
+class MOPIFilterThicknessChannelsPCCtrl(MOPIFilterThicknessPCCtrl):
+    """ The MOPI Filter Thickness Pseudo Counter Controller taking the
+    motor positions as pseudo counter inputs (e.g. 0D channels reading the
+    motor positions). It does not access the motors at all."""
+
+    ctrl_properties = {
+        name: prop
+        for name, prop in MOPIFilterThicknessPCCtrl.ctrl_properties.items()
+        if name in ('Offset', 'ThicknessTable')
+    }
+
+    counter_roles = ('mopi_lon', 'mopi_filt')
+
+    def Calc(self, index, counter_values):
+        mopi_lon, mopi_filt = counter_values
+        return self.calc_thickness(mopi_lon, mopi_filt)
@@ -1,8 +1,10 @@
 from sardana.pool.controller import PseudoMotorController, Description, \
     Type, Memorize, Memorized, Access, DataAccess
 
+from sardana_alba.ctrl.util.trajectory import TrajectoryMixin
 
-class MoveableMask(PseudoMotorController):
+
+class MoveableMask(TrajectoryMixin, PseudoMotorController):
     """ pseudomotor controller for Front end moveable masks"""
 
     pseudo_motor_roles = ['gap', 'offset']
@@ -42,10 +44,7 @@ class MoveableMask(PseudoMotorController):
             self._log.debug(
                 "pm_aperture,pm_offset = %f,%f" % (pm_aperture, pm_offset))
 
-            m_1 = (pm_aperture - self.aperture_origin + 2 * (
-                        pm_offset - self.offset_origin)) / 2.0
-            m_2 = (pm_aperture - self.aperture_origin - 2 * (
-                        pm_offset - self.offset_origin)) / 2.0
+            m_1, m_2 = self._to_physical(pm_aperture, pm_offset)
             self._log.debug("m_1, m_2 = %f,%f" % (m_1, m_2))
 
             return [m_1, m_2]
@@ -69,8 +68,7 @@ class MoveableMask(PseudoMotorController):
             m_1 = physical_pos[0]
             m_2 = physical_pos[1]
 
-            pm_aperture = (m_1 + m_2) + self.aperture_origin
-            pm_offset = (m_1 - m_2) / 2.0 + self.offset_origin
+            pm_aperture, pm_offset = self._to_pseudo(m_1, m_2)
 
             return [pm_aperture, pm_offset]
         except Exception as e:
@@ -78,6 +76,24 @@ class MoveableMask(PseudoMotorController):
             self._log.error(str(e))
             raise Exception("Error in CalcAllPseudo")
 
+    def _to_physical(self, pm_aperture, pm_offset):
+        m_1 = (pm_aperture - self.aperture_origin + 2 * (
+                    pm_offset - self.offset_origin)) / 2.0
+        m_2 = (pm_aperture - self.aperture_origin - 2 * (
+                    pm_offset - self.offset_origin)) / 2.0
+        return m_1, m_2
+
+    def _to_pseudo(self, m_1, m_2):
+        pm_aperture = (m_1 + m_2) + self.aperture_origin
+        pm_offset = (m_1 - m_2) / 2.0 + self.offset_origin
+        return pm_aperture, pm_offset
+
+    def _calc_all_physical_batch(self, pseudos, curr_physical_pos):
+        return self._to_physical(pseudos[0], pseudos[1])
+
+    def _calc_all_pseudo_batch(self, physicals, curr_pseudo_pos):
+        return self._to_pseudo(physicals[0], physicals[1])
+
     def GetCtrlPar(self, name):
 
         if name.lower() == "aperture_origin":
@@ -24,14 +24,17 @@
 
 """This module contains the definition of a two-coupled pseudomotor. """
 
+import numpy
 from sardana.pool.controller import PseudoMotorController, Description, Type
 
+from sardana_alba.ctrl.util.trajectory import TrajectoryMixin
+
 __all__ = ["TwoCoupledPseudoMotor"]
 
 __docformat__ = 'restructuredtext'
 
 
-class TwoCoupledPseudoMotor(PseudoMotorController):
+class TwoCoupledPseudoMotor(TrajectoryMixin, PseudoMotorController):
     """First version of the two coupled pseudo motor controller.This
     pseudo motor is mapped to two identical motors. Any action applied
     to the pseudo motor (move, set, etc...) is applied to both motors
@@ -66,7 +69,7 @@ class TwoCoupledPseudoMotor(PseudoMotorController):
 
     # Calculation of input motors values.
     def CalcPhysical(self, index, pseudo_pos, curr_physical_pos):
-        pass
+        return self.CalcAllPhysical(pseudo_pos, curr_physical_pos)[index - 1]
 
     def CalcAllPhysical(self, pseudo_pos, curr_physical_pos):
         # Validation of position can be included:
@@ -91,3 +94,19 @@ class TwoCoupledPseudoMotor(PseudoMotorController):
         pos = physical_pos[0]
 
         return pos
+
+    # Calculation of trajectories (batch of positions).
+    def _calc_all_physical_batch(self, pseudos, curr_physical_pos):
+        # the tolerance is validated against the current positions only,
+        # there is nothing to validate on a planned trajectory
+        pos = pseudos[0]
+        return pos, pos
+
+    def _calc_all_pseudo_batch(self, physicals, curr_pseudo_pos):
+        return physicals[:1]
+
+    def _calc_physical_jacobian_batch(self, pseudos):
+        return numpy.ones((pseudos.shape[1], 2, 1))
+
+    def _calc_pseudo_jacobian_batch(self, physicals):
+        return numpy.tile([[1.0, 0.0]], (physicals.shape[1], 1, 1))
@@ -0,0 +1,362 @@
+"""
+Batch (trajectory) API for the ALBA pseudo motor controllers.
+
+The Pool only needs the scalar ``CalcAllPhysical``/``CalcAllPseudo`` methods.
+Continuous scans and post-scan data reduction need to convert whole position
+streams instead, so :class:`TrajectoryMixin` adds batch variants which accept
+NumPy arrays with one row per trajectory point.
+
+Example::
+
+    class MySlit(TrajectoryMixin, PseudoMotorController):
+        ...
+
+    physicals = ctrl.CalcAllPhysicalBatch([[gap1, offset1],
+                                           [gap2, offset2]])
+
+Controllers whose geometry can be evaluated on arrays override
+``_calc_all_physical_batch``/``_calc_all_pseudo_batch``. The default
+implementations fall back to calling the scalar methods point by point.
+
+The mixin also provides the Jacobians of both transformations (numerical by
+default, controllers may override them with analytic ones) and a Newton
+solver which inverts ``CalcAllPseudo`` numerically. The solver is warm
+started from its previous solution, which makes consecutive calls along a
+trajectory converge in one or two iterations.
+
+Velocities and accelerations are mapped with the Jacobians evaluated at the
+trajectory points, e.g. to know the motor velocities needed to move a pseudo
+motor at constant speed during a continuous scan::
+
+    velocities = ctrl.CalcPhysicalVelocityBatch(pseudos, pseudo_velocities)
+"""
+
+import numpy
+
+__all__ = ["TrajectoryMixin", "as_points", "jacobian_from_rows",
+           "numerical_jacobian"]
+
+
+def as_points(positions, nb_axes):
+    """Convert positions to a 2D float array with one row per point.
+
+    :param positions: (sequence or numpy.ndarray) a single point (1D) or
+        a sequence of points (2D, shape N x nb_axes)
+    :param nb_axes: (int) expected number of coordinates of each point
+
+    :return: (tuple<numpy.ndarray, bool>) the points array and a flag which
+        is True when a single point was given"""
+    points = numpy.asarray(positions, dtype=float)
+    single = points.ndim == 1
+    points = numpy.atleast_2d(points)
+    if points.ndim != 2 or points.shape[1] != nb_axes:
+        raise ValueError("Expected points with %d coordinates, got array of "
+                         "shape %s" % (nb_axes, points.shape))
+    return points, single
+
+
+def _stack_columns(columns, nb_points):
+    """Stack per-axis columns (arrays or scalars) into a N x M array."""
+    columns = [numpy.broadcast_to(numpy.asarray(c, dtype=float), (nb_points,))
+               for c in columns]
+    return numpy.column_stack(columns)
+
+
+def jacobian_from_rows(rows, nb_points):
+    """Build a N x M x P Jacobian array from M rows of P partial derivatives.
+
+    :param rows: (sequence<sequence>) partial derivatives, each of them a
+        float or an array with one value per point
+    :param nb_points: (int) number of points N
+
+    :return: (numpy.ndarray) Jacobian, one M x P matrix per point"""
+    return numpy.stack([_stack_columns(row, nb_points) for row in rows],
+                       axis=1)
+
+
+def numerical_jacobian(func, columns, step):
+    """Central difference Jacobian of a vectorised geometry hook.
+
+    :param func: (callable) receives one array per input axis and returns
+        one array per output axis
+    :param columns: (numpy.ndarray) input positions, one row per axis
+    :param step: (float) finite difference step
+
+    :return: (numpy.ndarray) Jacobian, one matrix per point"""
+    nb_axes, nb_points = columns.shape
+    derivatives = []
+    for axis in range(nb_axes):
+        delta = numpy.zeros((nb_axes, 1))
+        delta[axis] = step
+        upper = _stack_columns(func(columns + delta), nb_points)
+        lower = _stack_columns(func(columns - delta), nb_points)
+        derivatives.append((upper - lower) / (2 * step))
+    return numpy.stack(derivatives, axis=-1)
+
+
+class TrajectoryMixin(object):
+    """Mixin giving pseudo motor controllers batch conversion methods.
+
+    It must be placed before the sardana controller class in the bases of
+    the controller. It relies on the ``pseudo_motor_roles`` and
+    ``motor_roles`` class members of the controller."""
+
+    #: finite difference step used by the numerical Jacobians
+    jacobian_step = 1e-6
+    #: maximum pseudo position error accepted by the numerical inverse
+    inverse_tolerance = 1e-9
+    #: maximum number of Newton iterations of the numerical inverse
+    inverse_max_iterations = 50
+
+    def CalcAllPhysicalBatch(self, pseudo_positions, curr_physical_pos=None):
+        """Calculates the physical positions for a sequence of pseudo
+        positions.
+
+        :param pseudo_positions: (numpy.ndarray) pseudo positions, one row
+            per point (or a single point)
+        :param curr_physical_pos: (sequence<float>) current physical
+            positions, only used by the scalar fallback
+
+        :return: (numpy.ndarray) physical positions, one row per point"""
+        pseudos, single = as_points(pseudo_positions,
+                                    len(self.pseudo_motor_roles))
+        columns = self._calc_all_physical_batch(pseudos.T, curr_physical_pos)
+        physicals = _stack_columns(columns, len(pseudos))
+        if single:
+            return physicals[0]
+        return physicals
+
+    def CalcAllPseudoBatch(self, physical_positions, curr_pseudo_pos=None):
+        """Calculates the pseudo positions for a sequence of physical
+        positions.
+
+        :param physical_positions: (numpy.ndarray) physical positions, one
+            row per point (or a single point)
+        :param curr_pseudo_pos: (sequence<float>) current pseudo positions,
+            only used by the scalar fallback
+
+        :return: (numpy.ndarray) pseudo positions, one row per point"""
+        physicals, single = as_points(physical_positions,
+                                      len(self.motor_roles))
+        columns = self._calc_all_pseudo_batch(physicals.T, curr_pseudo_pos)
+        pseudos = _stack_columns(columns, len(physicals))
+        if single:
+            return pseudos[0]
+        return pseudos
+
+    def _calc_all_physical_batch(self, pseudos, curr_physical_pos):
+        """Vectorised geometry hook. Receives one array per pseudo motor and
+        returns one array per physical motor. Default: scalar fallback."""
+        if curr_physical_pos is None:
+            curr_physical_pos = []
+        points = [self.CalcAllPhysical(list(p), curr_physical_pos)
+                  for p in numpy.transpose(pseudos)]
+        return numpy.reshape(points, (len(points), -1)).T
+
+    def _calc_all_pseudo_batch(self, physicals, curr_pseudo_pos):
+        """Vectorised geometry hook. Receives one array per physical motor
+        and returns one array per pseudo motor. Default: scalar fallback."""
+        if curr_pseudo_pos is None:
+            curr_pseudo_pos = []
+        points = [self.CalcAllPseudo(list(p), curr_pseudo_pos)
+                  for p in numpy.transpose(physicals)]
+        return numpy.reshape(points, (len(points), -1)).T
+
+    def CalcPhysicalJacobianBatch(self, pseudo_positions):
+        """Calculates the Jacobian of the physical positions with respect to
+        the pseudo positions (d physical / d pseudo).
+
+        :param pseudo_positions: (numpy.ndarray) pseudo positions, one row
+            per point (or a single point)
+
+        :return: (numpy.ndarray) one (physicals x pseudos) matrix per point"""
+        pseudos, single = as_points(pseudo_positions,
+                                    len(self.pseudo_motor_roles))
+        jacobian = self._calc_physical_jacobian_batch(pseudos.T)
+        if single:
+            return jacobian[0]
+        return jacobian
+
+    def CalcPseudoJacobianBatch(self, physical_positions):
+        """Calculates the Jacobian of the pseudo positions with respect to
+        the physical positions (d pseudo / d physical).
+
+        :param physical_positions: (numpy.ndarray) physical positions, one
+            row per point (or a single point)
+
+        :return: (numpy.ndarray) one (pseudos x physicals) matrix per point"""
+        physicals, single = as_points(physical_positions,
+                                      len(self.motor_roles))
+        jacobian = self._calc_pseudo_jacobian_batch(physicals.T)
+        if single:
+            return jacobian[0]
+        return jacobian
+
+    def CalcAllPhysicalNumerical(self, pseudo_pos, curr_physical_pos=None):
+        """Calculates the physical positions by inverting ``CalcAllPseudo``
+        numerically (Newton iterations, least squares steps when there are
+        more physical than pseudo motors).
+
+        The iterations start from the given current physical positions or,
+        if there are none, from the previous solution. The previous solution
+        is returned again for the same pseudo positions, unless the current
+        physical positions are given and they are not that solution (e.g.
+        the motors of a redundant controller were moved).
+
+        :param pseudo_pos: (sequence<float>) pseudo positions
+        :param curr_physical_pos: (sequence<float>) current physical
+            positions
+
+        :return: (numpy.ndarray) physical positions"""
+        target = numpy.asarray(pseudo_pos, dtype=float)
+        current = None
+        if curr_physical_pos is not None and len(curr_physical_pos):
+            current = numpy.asarray(curr_physical_pos, dtype=float)
+        cache = getattr(self, '_inverse_cache', None)
+        if cache is not None:
+            last_pseudos, last_physicals = cache
+            same_physicals = current is None or numpy.allclose(
+                last_physicals, current, rtol=0, atol=self.inverse_tolerance)
+            if same_physicals and numpy.allclose(
+                    last_pseudos, target, rtol=0,
+                    atol=self.inverse_tolerance):
+                return last_physicals.copy()
+        if current is not None:
+            guess = current
+        elif cache is not None:
+            guess = cache[1]
+        else:
+            guess = numpy.zeros(len(self.motor_roles))
+        physicals = self._solve_physical(target, guess)
+        self._inverse_cache = target, physicals
+        return physicals.copy()
+
+    def CalcAllPhysicalNumericalBatch(self, pseudo_positions,
+                                      curr_physical_pos=None):
+        """Numerical inverse of a trajectory. Each point is warm started
+        from the solution of the previous one.
+
+        :param pseudo_positions: (numpy.ndarray) pseudo positions, one row
+            per point
+        :param curr_physical_pos: (sequence<float>) current physical
+            positions
+
+        :return: (numpy.ndarray) physical positions, one row per point"""
+        pseudos, single = as_points(pseudo_positions,
+                                    len(self.pseudo_motor_roles))
+        # only the first point starts from the current positions
+        physicals = numpy.array([
+            self.CalcAllPhysicalNumerical(
+                p, curr_physical_pos if i == 0 else None)
+            for i, p in enumerate(pseudos)])
+        if single:
+            return physicals[0]
+        return physicals
+
+    def CalcPhysicalVelocityBatch(self, pseudo_positions, pseudo_velocities):
+        """Maps pseudo velocities to physical velocities at the given
+        trajectory points (v_physical = J v_pseudo).
+
+        :param pseudo_positions: (numpy.ndarray) pseudo positions, one row
+            per point
+        :param pseudo_velocities: (numpy.ndarray) pseudo velocities, same
+            shape as pseudo_positions
+
+        :return: (numpy.ndarray) physical velocities, one row per point"""
+        pseudos, single = as_points(pseudo_positions,
+                                    len(self.pseudo_motor_roles))
+        velocities = numpy.broadcast_to(
+            numpy.asarray(pseudo_velocities, dtype=float), pseudos.shape)
+        jacobian = self._calc_physical_jacobian_batch(pseudos.T)
+        physical_velocities = numpy.einsum('nij,nj->ni', jacobian, velocities)
+        if single:
+            return physical_velocities[0]
+        return physical_velocities
+
+    def CalcPhysicalAccelerationBatch(self, pseudo_positions,
+                                      pseudo_velocities, pseudo_accelerations):
+        """Maps pseudo accelerations to physical accelerations at the given
+        trajectory points (a_physical = J a_pseudo + dJ/dt v_pseudo). The
+        derivative of the Jacobian along the velocity is numerical.
+
+        :param pseudo_positions: (numpy.ndarray) pseudo positions, one row
+            per point
+        :param pseudo_velocities: (numpy.ndarray) pseudo velocities, same
+            shape as pseudo_positions
+        :param pseudo_accelerations: (numpy.ndarray) pseudo accelerations,
+            same shape as pseudo_positions
+
+        :return: (numpy.ndarray) physical accelerations, one row per point"""
+        pseudos, single = as_points(pseudo_positions,
+                                    len(self.pseudo_motor_roles))
+        velocities = numpy.broadcast_to(
+            numpy.asarray(pseudo_velocities, dtype=float), pseudos.shape)
+        accelerations = numpy.broadcast_to(
+            numpy.asarray(pseudo_accelerations, dtype=float), pseudos.shape)
+        step = self.jacobian_step
+        jacobian = self._calc_physical_jacobian_batch(pseudos.T)
+        upper = self._calc_physical_jacobian_batch((pseudos
+                                                    + step * velocities).T)
+        lower = self._calc_physical_jacobian_batch((pseudos
+                                                    - step * velocities).T)
+        jacobian_dot = (upper - lower) / (2 * step)
+        physical_accelerations = (
+            numpy.einsum('nij,nj->ni', jacobian, accelerations)
+            + numpy.einsum('nij,nj->ni', jacobian_dot, velocities))
+        if single:
+            return physical_accelerations[0]
+        return physical_accelerations
+
+    def CalcPseudoVelocityBatch(self, physical_positions, physical_velocities):
+        """Maps physical velocities to pseudo velocities at the given
+        trajectory points (v_pseudo = J v_physical).
+
+        :param physical_positions: (numpy.ndarray) physical positions, one
+            row per point
+        :param physical_velocities: (numpy.ndarray) physical velocities,
+            same shape as physical_positions
+
+        :return: (numpy.ndarray) pseudo velocities, one row per point"""
+        physicals, single = as_points(physical_positions,
+                                      len(self.motor_roles))
+        velocities = numpy.broadcast_to(
+            numpy.asarray(physical_velocities, dtype=float), physicals.shape)
+        jacobian = self._calc_pseudo_jacobian_batch(physicals.T)
+        pseudo_velocities = numpy.einsum('nij,nj->ni', jacobian, velocities)
+        if single:
+            return pseudo_velocities[0]
+        return pseudo_velocities
+
+    def ResetNumericalInverse(self):
+        """Forgets the previous solution of the numerical inverse. It must
+        be called when the geometry (e.g. a calibration) changes."""
+        self._inverse_cache = None
+
+    def _solve_physical(self, target, guess):
+        physicals = numpy.array(guess, dtype=float)
+        for _ in range(self.inverse_max_iterations):
+            columns = physicals[:, numpy.newaxis]
+            error = _stack_columns(
+                self._calc_all_pseudo_batch(columns, None), 1)[0] - target
+            if numpy.max(numpy.abs(error)) <= self.inverse_tolerance:
+                return physicals
+            jacobian = self._calc_pseudo_jacobian_batch(columns)[0]
+            step = numpy.linalg.lstsq(jacobian, -error, rcond=None)[0]
+            physicals += step
+        raise ValueError("Numerical inverse of %s did not converge for "
+                         "pseudo positions %s" % (type(self).__name__,
+                                                  list(target)))
+
+    def _calc_physical_jacobian_batch(self, pseudos):
+        """Jacobian hook. Receives one array per pseudo motor and returns
+        one (physicals x pseudos) matrix per point. Default: numerical."""
+        return numerical_jacobian(
+            lambda p: self._calc_all_physical_batch(p, None),
+            pseudos, self.jacobian_step)
+
+    def _calc_pseudo_jacobian_batch(self, physicals):
+        """Jacobian hook. Receives one array per physical motor and returns
+        one (pseudos x physicals) matrix per point. Default: numerical."""
+        return numerical_jacobian(
+            lambda p: self._calc_all_pseudo_batch(p, None),
+            physicals, self.jacobian_step)
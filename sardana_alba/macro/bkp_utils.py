@@ -1,10 +1,15 @@
 from sardana.macroserver.macro import macro, Type, Macro
 import configparser
-import time
+import difflib
+import os
 import PyTango
 import sardana
 import json
 
+from sardana_alba.macro.util.mntgrp_config import diff_configs, \
+    patch_config
+from sardana_alba.macro.util.mntgrp_history import MntGrpHistory
+
 # TODO: Uncomment when fandango is migrated to python3
 # import fandango
 #
@@ -183,6 +188,10 @@ import json
 class MntGrpConf(object):
     """
     Class Helper to read the configuration file.
+
+    Every saved configuration is also added to the history of configurations
+    (directory mntgrp_history next to the configuration file), see the macros
+    mntgrp_history, mntgrp_diff and mntgrp_restore.
     """
 
     def _tolist(self, data):
@@ -190,14 +199,6 @@ class MntGrpConf(object):
         data = data.replace(',', ' ')
         return data.split()
 
-    def _create_bkp(self):
-        self.info('Creating backup...')
-        path, filename = self.config_path.rsplit('/', 1)
-        t = '{0}/bkp_{1}_{2}'
-        nfilename = t.format(path,time.strftime('%Y%m%d_%H%M%S'), filename)
-        self._save_file(nfilename)
-        self.info('Created backup file: %s' % nfilename)
-
     def _save_file(self, filename):
         """
         :param filename: New file name to save the current configuration.
@@ -209,6 +210,11 @@ class MntGrpConf(object):
         self.config_file = configparser.RawConfigParser()
         self.config_file.read(config_path)
         self.config_path = config_path
+        self.init_history(config_path)
+
+    def init_history(self, config_path):
+        path = os.path.join(os.path.dirname(config_path), 'mntgrp_history')
+        self.history = MntGrpHistory(path)
 
     def get_config(self, mnt_grp):
         mnt_grp = mnt_grp.lower()
@@ -223,7 +229,12 @@ class MntGrpConf(object):
         return config_value
 
     def save(self, mnt_grp, config):
-        self._create_bkp()
+        revision, new = self.history.save(mnt_grp, config)
+        if new:
+            self.info('Added revision %s to the history' % revision)
+        else:
+            self.info('Same configuration as revision %s of the history' %
+                      revision)
         self.info('Saving configuration....')
         mnt_grp = mnt_grp.lower()
         if not self.config_file.has_section(mnt_grp):
@@ -232,6 +243,36 @@ class MntGrpConf(object):
         self._save_file(self.config_path)
         self.output('Saved configuration.')
 
+    def load(self, mg, config):
+        """Load a configuration in the measurement group. Only the settings
+        which are different are changed, nothing is written if the
+        configurations are the same.
+
+        :return: (bool) True if the measurement group was changed"""
+        mg_config = mg.read_attribute('configuration').value
+        changes, same_channels = diff_configs(mg_config, config)
+        if same_channels and not changes:
+            self.output('The current configuration is the same than the '
+                        'backup')
+            return False
+        self.warning('The current configuration is not the same than the '
+                     'backup')
+        others = set()
+        for change in changes:
+            if change.reported:
+                self.info('  %r' % change)
+            else:
+                others.add(change.key)
+        if others:
+            self.info('  other settings: %s' % ', '.join(sorted(others)))
+        if same_channels:
+            config = patch_config(mg_config, changes)
+        else:
+            # channels were added or removed, load the whole backup
+            self.info('  the channels are different')
+        mg.write_attribute('configuration', config)
+        return True
+
 
 class save_mntgrp(Macro, MntGrpConf):
     """
@@ -274,14 +315,95 @@ class load_mntgrp(Macro, MntGrpConf):
         self.init_config(config_path)
 
         mg_bkp_config = self.get_config(mg.getName())
-        mg_config = mg.read_attribute('configuration').value
-        diff_conf = mg_config != mg_bkp_config
-        msg = 'The current configuration %s the same than the backup' % \
-              ['is', 'is not'][diff_conf]
-        if diff_conf:
-            self.warning(msg)
-            self.info('Loading backup...')
-            mg.write_attribute('configuration', mg_bkp_config)
+        self.info('Loading backup...')
+        if self.load(mg, mg_bkp_config):
             self.output('Loaded backup')
+
+
+class mntgrp_history(Macro, MntGrpConf):
+    """
+    Macro to list the revisions of the measurement group configurations
+    saved with save_mntgrp.
+
+    Other macros: mntgrp_diff, mntgrp_restore
+    """
+
+    env = ('MntGrpConfFile',)
+    param_def = [['mg', Type.String, '', 'Measurement Group, all of them '
+                                         'by default']]
+
+    def run(self, mg):
+        self.init_history(self.getEnv('MntGrpConfFile'))
+        revisions = self.history.revisions(mg or None)
+        if not revisions:
+            self.output('There is no history')
+            return
+        for revision in revisions:
+            self.output('%s  %s  %s' % (revision['id'], revision['date'],
+                                        revision['mg']))
+
+
+class mntgrp_diff(Macro, MntGrpConf):
+    """
+    Macro to compare a revision of the measurement group configuration with
+    another one or, by default, with the current configuration.
+
+    Other macros: mntgrp_history, mntgrp_restore
+    """
+
+    env = ('MntGrpConfFile',)
+    param_def = [['mg', Type.MeasurementGroup, None, 'Measurement Group'],
+                 ['revision', Type.String, '', 'Revision id, the last one '
+                                               'by default'],
+                 ['other', Type.String, '', 'Revision id to compare with, '
+                                            'the current configuration by '
+                                            'default']]
+
+    @staticmethod
+    def _lines(config):
+        return json.dumps(json.loads(config), indent=2,
+                          sort_keys=True).splitlines()
+
+    def run(self, mg, revision, other):
+        self.init_history(self.getEnv('MntGrpConfFile'))
+        name = mg.getName()
+        old = self.history.get_revision(name, revision)
+        config = self.history.get(name, old['id'])
+        if other:
+            new = self.history.get_revision(name, other)
+            new_config = self.history.get(name, new['id'])
+            new_label = '%s (%s)' % (new['id'], new['date'])
+        else:
+            new_config = mg.read_attribute('configuration').value
+            new_label = 'current'
+        diff = list(difflib.unified_diff(
+            self._lines(config), self._lines(new_config),
+            '%s (%s)' % (old['id'], old['date']), new_label, lineterm=''))
+        if diff:
+            self.output('\n'.join(diff))
         else:
-            self.output(msg)
+            self.output('The configurations are the same')
+
+
+class mntgrp_restore(Macro, MntGrpConf):
+    """
+    Macro to load a revision of the measurement group configuration from the
+    history.
+
+    Other macros: mntgrp_history, mntgrp_diff
+    """
+
+    env = ('MntGrpConfFile',)
+    param_def = [['mg', Type.MeasurementGroup, None, 'Measurement Group'],
+                 ['revision', Type.String, '', 'Revision id, the last one '
+                                               'by default']]
+
+    def run(self, mg, revision):
+        self.init_history(self.getEnv('MntGrpConfFile'))
+        name = mg.getName()
+        revision = self.history.get_revision(name, revision)
+        config = self.history.get(name, revision['id'])
+        self.info('Loading revision %s (%s)...' % (revision['id'],
+                                                   revision['date']))
+        if self.load(mg, config):
+            self.output('Loaded revision %s' % revision['id'])
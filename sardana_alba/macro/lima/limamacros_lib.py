@@ -4,11 +4,13 @@
 import taurus
 import PyTango
 import os, errno
-import time
 import functools
+import collections
 
 from sardana.macroserver.macro import Macro, Type
 
+from sardana_alba.macro.util.deadline import Deadline, sleep_until
+
 
 def catch_error(meth):
     @functools.wraps(meth)
@@ -18,7 +20,8 @@ def catch_error(meth):
         except Exception as e1:
             self.debug(e1)
             try:  
-                self.error("Macro %s failed with argument %s" %(meth.__name__ , " ".join(args)))
+                self.error("Macro %s failed with argument %s" %
+                           (meth.__name__, " ".join(map(str, args))))
             except Exception as e2:
                 self.error("Error processing  _catch_error, args[0].")
             finally:
@@ -26,14 +29,116 @@ def catch_error(meth):
     return _catch_error
 
 
+_lima_devices = {}
+
+
 def get_lima_device(dev):
+    """Return the device of the LimaCCDs, created only the first time"""
+    try:
+        return _lima_devices[dev.lower()]
+    except KeyError:
+        pass
     lima_dev = taurus.Device(dev)
     if dev.lower() == 'rayonix':
         # MSPD Rayonix problems See CS-25213
         lima_dev.set_timeout_millis(30000)
+    _lima_devices[dev.lower()] = lima_dev
     return lima_dev
 
 
+#: configuration parameters and their LimaCCDs attributes
+LIMA_CONFIG = collections.OrderedDict([
+    ('FileDir', 'saving_directory'),
+    ('FilePrefix', 'saving_prefix'),
+    ('FileFormat', 'saving_format'),
+    ('NbFrames', 'acq_nb_frames'),
+    ('ExposureTime', 'acq_expo_time'),
+    ('LatencyTime', 'latency_time'),
+    ('TriggerMode', 'acq_trigger_mode'),
+    ('NextNumber', 'saving_next_number'),
+    ('SavingMode', 'saving_mode')])
+
+
+def get_lima_config(dev, params=None):
+    """Read configuration parameters of a LimaCCDs with a single
+    read_attributes call.
+
+    :param dev: (str) device name or alias
+    :param params: (seq<str>) parameter names (see LIMA_CONFIG), None or
+        empty for all of them
+
+    :return: (OrderedDict) parameter values by name"""
+    if not params:
+        params = list(LIMA_CONFIG)
+    unknown = [p for p in params if p not in LIMA_CONFIG]
+    if unknown:
+        raise ValueError('Unknown parameter(s) %s, the parameters are: %s'
+                         % (', '.join(unknown), ', '.join(LIMA_CONFIG)))
+    lima = get_lima_device(dev)
+    attrs = lima.read_attributes([LIMA_CONFIG[p] for p in params])
+    return collections.OrderedDict(
+        (p, attr.value) for p, attr in zip(params, attrs))
+
+
+#: limits of the period between reads while waiting for an acquisition
+MIN_POLL_PERIOD = 0.01
+MAX_POLL_PERIOD = 0.5
+
+
+def wait_lima_acquisition(dev, check_point=None, start=None):
+    """Wait until the acquisition of a LimaCCDs is not Running.
+
+    acq_status and last_image_ready are read together in one call. The
+    period between reads starts at MIN_POLL_PERIOD, is doubled while nothing
+    changes and goes back to MIN_POLL_PERIOD when a new frame is ready. It
+    is never longer than a quarter of the frame time (acq_expo_time plus
+    latency_time) nor MAX_POLL_PERIOD, so the frames and the end are seen
+    soon after they happen.
+
+    :param dev: (str) device name or alias
+    :param check_point: (callable) called while waiting (e.g. the macro
+        checkPoint, to allow aborting it)
+    :param start: (Deadline) created just before starting the acquisition,
+        None to measure from the call
+
+    :return: (dict) acq_status, frames (number of frames ready), elapsed
+        (time from the start until the end was detected), fps (frames per
+        second from the start until the first read with the final number of
+        frames) and latency (time from that read until the end was
+        detected), the last two None without frames. The times are as
+        accurate as the reads, so they are approximations."""
+    lima = get_lima_device(dev)
+    if start is None:
+        start = Deadline()
+    expo_time, latency_time = [attr.value for attr in lima.read_attributes(
+        ['acq_expo_time', 'latency_time'])]
+    max_period = min(MAX_POLL_PERIOD,
+                     max(MIN_POLL_PERIOD, (expo_time + latency_time) / 4))
+    period = MIN_POLL_PERIOD
+    last_image = -1
+    last_image_time = None
+    while True:
+        status, image = [attr.value for attr in lima.read_attributes(
+            ['acq_status', 'last_image_ready'])]
+        if image != last_image:
+            last_image = image
+            last_image_time = start.elapsed
+            period = MIN_POLL_PERIOD
+        if status != 'Running':
+            break
+        sleep_until(Deadline(period), check_point)
+        period = min(2 * period, max_period)
+    elapsed = start.elapsed
+    frames = last_image + 1
+    result = {'acq_status': status, 'frames': frames, 'elapsed': elapsed,
+              'fps': None, 'latency': None}
+    if frames > 0:
+        if last_image_time > 0:
+            result['fps'] = frames / last_image_time
+        result['latency'] = elapsed - last_image_time
+    return result
+
+
 class lima_status(Macro):
     """Returns device and acquisition status."""
 
@@ -230,30 +335,27 @@ class lima_write_image(Macro):
 
 
 class lima_getconfig(Macro):
-    """Returns the desired parameter value
+    """Returns the desired parameter values, all of them if none is given.
+With one parameter the result is its value, otherwise it is a list of
+name=value separated by spaces.
 Parameter list:
     FileDir       FileFormat    ExposureTime    TriggerMode
     FilePrefix    NbFrames      LatencyTime     NextNumber     SavingMode"""
 
-    param_def =  [['dev',Type.String, None, 'Device name or alias'],
-                  ['paramIn',Type.String, None, 'Parameter name.']]
-    result_def = [['paramOut',Type.String, None, 'Parameter value']]
-        
-    param_list = {'FileDir': 'saving_directory',
-                 'FilePrefix': 'saving_prefix',
-                 'FileFormat': 'saving_format',
-                 'NbFrames': 'acq_nb_frames',
-                 'ExposureTime': 'acq_expo_time',
-                 'LatencyTime': 'latency_time',
-                 'TriggerMode':'acq_trigger_mode',
-                 'NextNumber':'saving_next_number',
-                 'SavingMode':'saving_mode'}
+    param_def = [['dev', Type.String, None, 'Device name or alias'],
+                 ['paramIn', [['param', Type.String, None, 'Parameter name'],
+                              {'min': 0}],
+                  [], 'Parameter names, all if empty']]
+    result_def = [['paramOut', Type.String, None, 'Parameter value(s)']]
+
+    param_list = LIMA_CONFIG
 
     @catch_error
-    def run(self,dev,param):
-        lima = get_lima_device(dev)
-        value = lima.read_attribute(self.param_list[param]).value
-        return str(value)
+    def run(self, dev, params):
+        config = get_lima_config(dev, params)
+        if len(config) == 1:
+            return str(list(config.values())[0])
+        return ' '.join('%s=%s' % item for item in config.items())
 
 
 
@@ -264,10 +366,8 @@ class lima_printconfig(Macro):
 
     @catch_error
     def run(self,dev):
-
-        for par in lima_getconfig.param_list:            
-            result = self.execMacro(['lima_getconfig', dev, par])
-            self.info("%s = %s" % (par, result.getResult()))
+        for par, value in get_lima_config(dev).items():
+            self.info("%s = %s" % (par, value))
 
 
 
@@ -444,28 +544,26 @@ class lima_take(Macro):
         self.device = dev
 
     def on_abort(self):
-        lima = taurus.Device(self.device)
+        lima = get_lima_device(self.device)
         lima.stopAcq()
 
     @catch_error
     def run(self, dev, bdir, texp, tlat, nf, pref, form, auto, trig):
         self.execMacro(['lima_saving', dev, bdir, pref, form, auto]) 
         self.execMacro(['lima_prepare', dev, texp, tlat, nf, trig]) 
+        start = Deadline()
         self.execMacro(['lima_acquire', dev]) 
         self.info("Started")
-        
-        status = self.execMacro('lima_status',dev)
-        state, acq = status.getResult().split()
-        self.info(acq)
-
-        while True:
-            status = self.execMacro('lima_status',dev)
-            state, acq = status.getResult().split()
-            time.sleep(0.5)
-            if acq != 'Running' :
-                break
-            
-        self.info(acq)
+
+        result = wait_lima_acquisition(dev, self.checkPoint, start)
+        self.info(result['acq_status'])
+        msg = "%d frame(s) in %.3f s" % (result['frames'], result['elapsed'])
+        if result['fps'] is not None:
+            msg += ", %.2f fps" % result['fps']
+        if result['latency'] is not None:
+            msg += ", end detected ~%.3f s after the last frame " \
+                "(approximate)" % result['latency']
+        self.info(msg)
 
 
 class lima_macros_test(Macro):
@@ -524,13 +622,7 @@ class lima_macros_test(Macro):
         self.execMacro("lima_saving", dev, "/tmp", "LimaTest", "EDF", False)
         self.execMacro("lima_prepare", dev)
         self.execMacro("lima_acquire", dev)
-        
-        while True:
-            status = self.execMacro('lima_status',dev)
-            state, acq = status.getResult().split()
-            time.sleep(0.5)
-            if acq != 'Running' :
-                break
+        wait_lima_acquisition(dev, self.checkPoint)
 
         self.execMacro("lima_image_header", dev,
                        ["0;ImageHeader=True|Image=0"])
@@ -1,11 +1,13 @@
-import time
-
 from sardana.macroserver.macro import Macro, Type
 
 
 class MGManager(object):
     """
     Class to manages the measurement group
+
+    The channels are enabled/disabled by computing the channels which must be
+    enabled and writing the configuration of the measurement group only once,
+    and only if some channel changes.
     """
 
     def __init__(self, macro_obj, mnt_grp, channels=None):
@@ -15,7 +17,8 @@ class MGManager(object):
 
     def __filterMntChannels(self, channels):
         # Check if the channels exit in the mntGrp
-        self.all_channels_names = self.mnt_grp.getChannelNames()
+        self.channels = [dict(ch) for ch in self.mnt_grp.getChannels()]
+        self.all_channels_names = [ch['name'] for ch in self.channels]
         if channels is None:
             return
         channels_names = []
@@ -33,30 +36,64 @@ class MGManager(object):
                 self.macro.warning(msg)
         self.channels_names = channels_names
 
+    @property
+    def enabled_channels_names(self):
+        return set(ch['name'] for ch in self.channels
+                   if ch.get('enabled', True))
+
+    def set_enabled_channels(self, enabled):
+        """Enable the given channels and disable the others with a single
+        write of the configuration.
+
+        :param enabled: (seq<str>) names of the channels to enable
+
+        :return: (bool) False if the channels were already like that"""
+        enabled = set(enabled)
+        current = self.enabled_channels_names
+        to_enable = [n for n in self.all_channels_names
+                     if n in enabled and n not in current]
+        to_disable = [n for n in self.all_channels_names
+                      if n not in enabled and n in current]
+        if not to_enable and not to_disable:
+            return False
+        if to_enable:
+            self.mnt_grp.setEnabled(True, *to_enable, apply=False)
+        if to_disable:
+            self.mnt_grp.setEnabled(False, *to_disable, apply=False)
+        self.mnt_grp.applyConfiguration()
+        for channel in self.channels:
+            channel['enabled'] = channel['name'] in enabled
+        return True
+
+    def _report(self, changed, msg):
+        if not changed:
+            msg += ' (nothing changed)'
+        self.macro.output(msg)
+
     def enable_channels(self):
-        self.mnt_grp.enableChannels(self.channels_names)
-        self.macro.output('Channels enabled')
+        changed = self.set_enabled_channels(
+            self.enabled_channels_names | set(self.channels_names))
+        self._report(changed, 'Channels enabled')
 
     def enable_only_channels(self):
-        dis_ch = list(set(self.all_channels_names) - set(self.channels_names))
-        self.disable_only_channels(dis_ch)
-        self.macro.output('Enabled only the selected channels')
+        changed = self.set_enabled_channels(self.channels_names)
+        self._report(changed, 'Enabled only the selected channels')
 
     def disable_channels(self):
-        self.mnt_grp.disableChannels(self.channels_names)
-        self.macro.output('Channels disabled')
+        changed = self.set_enabled_channels(
+            self.enabled_channels_names - set(self.channels_names))
+        self._report(changed, 'Channels disabled')
 
     def disable_only_channels(self, dis_ch=None):
-        self.mnt_grp.enableChannels(self.all_channels_names)
-        time.sleep(0.2)
         if dis_ch is None:
             dis_ch = self.channels_names
-        self.mnt_grp.disableChannels(dis_ch)
-        self.macro.output('Disable only the selected channels')
+        changed = self.set_enabled_channels(
+            set(self.all_channels_names) - set(dis_ch))
+        self._report(changed, 'Disable only the selected channels')
 
     def enable_all(self):
-        self.mnt_grp.enableChannels(self.all_channels_names)
-        self.macro.output('Enable all the channels')
+        changed = self.set_enabled_channels(self.all_channels_names)
+        self._report(changed, 'Enable all the channels')
 
     # Unsafe to use it
     # def disable_all(self):
@@ -67,7 +104,7 @@ class MGManager(object):
         out_line = '{0:<15} {1:^10} {2:^10} {3:^10} {4:^10}'
         self.macro.output(out_line.format('Channel', 'Enabled', 'Plot_type',
                                           'Plot axes', 'Output'))
-        for channel in self.mnt_grp.getChannels():
+        for channel in self.channels:
             name = channel['name']
             enabled = ['False', 'True'][channel['enabled']]
             plot_type = ['No', 'Spectrum', 'Image'][channel['plot_type']]
@@ -77,6 +114,79 @@ class MGManager(object):
                                               plot_axis, output))
 
 
+class MGProfiles(object):
+    """
+    Registry of named measurement group profiles stored in the environment
+    variable MntGrpProfiles.
+
+    A profile is a measurement group and, optionally, the channels enabled
+    for it. Using a profile makes its measurement group the active one and,
+    if it has channels, enables only them with a single write of the
+    configuration (nothing is written if they are already enabled). A profile
+    without channels is bound to a measurement group prepared beforehand, so
+    using it only changes the environment.
+
+    The channels of a profile are validated against the channels of the
+    measurement group when the profile is added, and again only if the
+    channels of the measurement group change.
+    """
+
+    ENV = 'MntGrpProfiles'
+
+    def __init__(self, macro_obj):
+        self.macro = macro_obj
+        try:
+            self.profiles = dict(self.macro.getEnv(self.ENV))
+        except Exception:
+            self.profiles = {}
+
+    def _save(self):
+        self.macro.setEnv(self.ENV, self.profiles)
+
+    def get(self, name):
+        try:
+            return self.profiles[name]
+        except KeyError:
+            raise ValueError('There is no profile {0}, the profiles are: '
+                             '{1}'.format(name, ', '.join(self.profiles)))
+
+    def add(self, name, mnt_grp, channels=None):
+        """Add (or replace) a profile. Without channels it is bound to the
+        measurement group as it is."""
+        profile = {'mntgrp': mnt_grp.getName(), 'channels': None}
+        if channels:
+            mg_manager = MGManager(self.macro, mnt_grp, channels)
+            profile['channels'] = mg_manager.channels_names
+            profile['signature'] = mg_manager.all_channels_names
+        self.profiles[name] = profile
+        self._save()
+
+    def remove(self, name):
+        self.get(name)
+        self.profiles.pop(name)
+        self._save()
+
+    def use(self, name):
+        profile = self.get(name)
+        mnt_grp_name = profile['mntgrp']
+        if profile['channels'] is not None:
+            mnt_grp = self.macro.getMeasurementGroup(mnt_grp_name)
+            mg_manager = MGManager(self.macro, mnt_grp)
+            if mg_manager.all_channels_names != profile['signature']:
+                # the measurement group changed, validate the profile again
+                mg_manager = MGManager(self.macro, mnt_grp,
+                                       profile['channels'])
+                profile['channels'] = mg_manager.channels_names
+                profile['signature'] = mg_manager.all_channels_names
+                self._save()
+            else:
+                mg_manager.channels_names = profile['channels']
+            mg_manager.enable_only_channels()
+        self.macro.setEnv('ActiveMntGrp', mnt_grp_name)
+        self.macro.info('Profile %s: Active Measurement Group : %s' %
+                        (name, mnt_grp_name))
+
+
 class meas_enable_ch(Macro):
     """
     Enable the Counter Timers selected
@@ -219,3 +329,72 @@ class select_mntGrp(Macro):
     def run(self, mntGrp):
         self.setEnv('ActiveMntGrp', str(mntGrp))
         self.info("Active Measurement Group : %s" % str(mntGrp))
+
+
+class mg_profile_add(Macro):
+    """
+    Add a measurement group profile. With channels, using the profile enables
+    only them in the measurement group. Without channels, the profile is
+    bound to the measurement group as it is.
+
+    Other macros: mg_profile_use, mg_profile_list, mg_profile_rm
+    """
+
+    param_def = [
+        ['name', Type.String, None, 'Profile name'],
+        ['MeasurementGroup', Type.MeasurementGroup, None,
+         "Measurement Group of the profile"],
+        ['channels', [
+            ['channel', Type.ExpChannel, None, 'Channel to enable'],
+            {'min': 0}],
+            [], 'List of channels to enable'],
+    ]
+
+    def run(self, name, mntGrp, channels):
+        MGProfiles(self).add(name, mntGrp, channels)
+
+
+class mg_profile_use(Macro):
+    """
+    Make active the measurement group of a profile and enable its channels.
+
+    Other macros: mg_profile_add, mg_profile_list, mg_profile_rm
+    """
+
+    param_def = [['name', Type.String, None, 'Profile name']]
+
+    def run(self, name):
+        MGProfiles(self).use(name)
+
+
+class mg_profile_list(Macro):
+    """
+    Show the measurement group profiles.
+
+    Other macros: mg_profile_add, mg_profile_use, mg_profile_rm
+    """
+
+    def run(self):
+        profiles = MGProfiles(self).profiles
+        out_line = '{0:<15} {1:<20} {2}'
+        self.output(out_line.format('Profile', 'MntGrp', 'Channels'))
+        for name, profile in sorted(profiles.items()):
+            channels = profile['channels']
+            if channels is None:
+                channels = '(bound)'
+            else:
+                channels = ' '.join(channels)
+            self.output(out_line.format(name, profile['mntgrp'], channels))
+
+
+class mg_profile_rm(Macro):
+    """
+    Remove a measurement group profile.
+
+    Other macros: mg_profile_add, mg_profile_use, mg_profile_list
+    """
+
+    param_def = [['name', Type.String, None, 'Profile name']]
+
+    def run(self, name):
+        MGProfiles(self).remove(name)
@@ -29,7 +29,13 @@ __all__ = ['seq_path', 'seq_run']
 __docformat__ = 'restructuredtext'
 
 import os
+import time
+
 from sardana.macroserver.macro import Type, Macro
+from sardana.util.parser import ParamParser
+
+from sardana_alba.macro.util.sequence import read_sequence, fuse_lines, \
+    SequenceCheckpoint, SequenceTimingLog
 
 
 class seq_path(Macro):
@@ -68,7 +74,30 @@ class seq_run(Macro):
 
     # Sample 2
     #mv mot13 12
+
+    # Samples 3 to 5, each of them at 3 energies
+    for sample in range 3 6
+        mv mot13 ${sample}0
+        for energy in 7000 7050 7100
+            mv energy $energy
+            ascanct mot14 0 10 10 0.1
+        end
+    end
     .....
+
+    The loops are expanded before running the sequence, every macro of the
+    expanded sequence is executed as one line. With the fuse parameter,
+    consecutive mv/umv/mvr/umvr lines of different motors are executed as a
+    single macro which moves all the motors at the same time. Do not use it
+    if the order of the movements matters.
+
+    The whole file is validated (macro names and parameters) before
+    running the first macro. The progress is saved in the file
+    <filename>.checkpoint, so an interrupted sequence can be continued
+    with the resume parameter, e.g. "seq_run sample.txt False True".
+
+    Each run writes the start/end time, wall time and error status of every
+    line to <filename>.timing_<date>.csv and prints a timing summary.
     """
     env = ('SequencyPath',)
 
@@ -78,35 +107,93 @@ class seq_run(Macro):
                                           'macros.'],
         ['skip_errors', Type.Boolean, False, 'Skip error on the macro '
                                              'execution and continue the '
-                                             'sequence']
+                                             'sequence'],
+        ['resume', Type.Boolean, False, 'Resume the sequence from the first '
+                                        'line which did not finish'],
+        ['fuse', Type.Boolean, False, 'Fuse consecutive moves of different '
+                                      'motors in a single macro']
         ]
 
-    def run(self, filename, skip_error):
+    def _validate(self, lines):
+        """Resolve the macro and the parameters of every line. All the
+        errors are reported together."""
+        macro_manager = self.getMacroServer().macro_manager
+        door = self.getDoorObj()
+        errors = []
+        for line in lines:
+            try:
+                macro_info = self.getMacroInfo(line.macro_name)
+                if macro_info is None:
+                    raise ValueError('Unknown macro {0}'.format(
+                        line.macro_name))
+                parser = ParamParser(macro_info.get_parameter())
+                params = parser.parse(line.params_str)
+                line.macro = [line.macro_name] + params
+                # decode a copy, it consumes the macro name
+                macro_manager.decodeMacroParameters(door, list(line.macro))
+            except Exception as e:
+                errors.append('{0!r}\n{1}'.format(line, e))
+        if errors:
+            raise ValueError('The sequence has errors, nothing was '
+                             'executed:\n' + '\n'.join(errors))
+
+    def run(self, filename, skip_error, resume, fuse):
 
         if filename[0] not in ['/', '~']:
             seq_path = self.getEnv('SequencyPath')
             filename = os.path.join(seq_path, filename)
-        filename = os.path.abspath(filename)
+        filename = os.path.abspath(os.path.expanduser(filename))
+
+        lines, digest = read_sequence(filename)
+        self._validate(lines)
+        if fuse:
+            lines = fuse_lines(lines)
+            # the steps of a fused sequence are not the same
+            digest += '-fused'
+
+        checkpoint = SequenceCheckpoint(filename, digest)
+        if resume:
+            if checkpoint.load() and checkpoint.next_step < len(lines):
+                self.output('Resuming sequency from {0!r}'.format(
+                    lines[checkpoint.next_step]))
+            else:
+                self.warning('There is no checkpoint of this sequency, it '
+                             'runs from the beginning.')
 
         self.output('Running sequency: "{}"'.format(filename))
+        timing_log = SequenceTimingLog(filename)
         errors = []
-        with open(filename, 'r') as f:
-            for ln, line in enumerate(f):
-                line = line.strip('\r\n')
-                line = line.strip()
-                if len(line) == 0 or line[0] == '#':
-                    continue
-                try:
-                    self.output('\nRunning macro: "{0}"'.format(line))
-                    if line[0] == '%':
-                        line = line[1:]
-                    self.execMacro(line)
-                except Exception as e:
-                    errors.append((ln, line, e))
-                    if skip_error:
-                        self.warning('Skip error: {0}'.format(e))
-                    else:
-                        break
+        aborted = False
+        for step, line in enumerate(lines):
+            ln = line.line_number
+            if step < checkpoint.next_step:
+                continue
+            error = None
+            self.output('\nRunning macro: "{0}"'.format(line.text))
+            t0 = time.time()
+            try:
+                self.execMacro(line.macro)
+            except Exception as e:
+                error = e
+                errors.append((ln, line.text, e))
+                if skip_error:
+                    self.warning('Skip error: {0}'.format(e))
+                else:
+                    aborted = True
+            finally:
+                timing_log.add(line, t0, time.time(), error)
+            if aborted:
+                checkpoint.save(step)
+                break
+            checkpoint.save(step + 1)
+
+        if not aborted:
+            checkpoint.remove()
+
+        self.output('\n{0}\nTiming (saved in "{1}"):'.format(
+            '*' * 80, timing_log.filename))
+        for text in timing_log.summary():
+            self.output(text)
 
         self.output('\n{0}\nResume:'.format('*' * 80))
         if len(errors) > 0:
@@ -115,6 +202,9 @@ class seq_run(Macro):
             for ln, line, error in errors:
                 self.warning('Line {0:3d}: {1}\n{2}\n'.format(ln, line,
                                                               error))
+            if aborted:
+                self.warning('Run it again with resume to continue from '
+                             '{0!r}'.format(lines[checkpoint.next_step]))
         else:
             self.output('Done!')
 
@@ -1,11 +1,18 @@
 import logging
 import functools
+import collections
 
+import click
+import gevent
 import tangoctl
+import treelib
 
 from sardana.macroserver.macro import macro, Type, Optional
 
-from sardana_alba.macro.util.log import MacroOutputLogHandler
+from sardana_alba.macro.util.deadline import CHECK_PERIOD, Deadline
+from sardana_alba.macro.util.log import BufferedMacroOutputLogHandler
+from sardana_alba.macro.util.tango_snapshot import get_snapshot, \
+    compile_patterns, SNAPSHOT_TTL
 
 Servers = [
     'servers', [["server", Type.String, None, "server expression"]],
@@ -17,28 +24,205 @@ OptionalServers = [
     Optional, "optional list of servers (accepts server expression ex: Ni660x/*)"
 ]
 
-log_output = functools.partial(MacroOutputLogHandler, logger=tangoctl.log, level=logging.INFO)
+log_output = functools.partial(BufferedMacroOutputLogHandler,
+                               logger=tangoctl.log, level=logging.INFO)
+
+
+LOG_LEVELS = {"info": logging.INFO, "warn": logging.WARNING,
+              "error": logging.ERROR}
+
+#: time to stop a server before killing it (as in tangoctl)
+STOP_TIMEOUT = 5
+
+
+def _iter_stop_kill_server(starter, name, timeout=STOP_TIMEOUT):
+    """Like tangoctl Starter.iter_stop_kill_server, but it returns if the
+    server was stopped (the tangoctl one always returns None)"""
+    try:
+        with gevent.Timeout(timeout):
+            return (yield from starter.iter_stop_server(name))
+    except gevent.Timeout:
+        yield {"level": "warn", "text": "timeout trying to stop {0}. "
+               "Performing a kill".format(name)}
+        return (yield from starter.iter_kill_server(name))
+
+
+# (starter, server name) -> iterator of the progress messages which returns
+# True if the action succeeded
+ACTIONS = {
+    "start": lambda starter, name: starter.iter_start_server(name),
+    "stop": _iter_stop_kill_server,
+}
+
+
+def _get_env(macro_obj, name, default=None):
+    try:
+        return macro_obj.getEnv(name)
+    except Exception:
+        return default
+
+
+def _get_snapshot(macro_obj):
+    """Snapshot of the Tango database which is read again after
+    TangoSnapshotTTL seconds (environment variable, 60 by default)"""
+    return get_snapshot(_get_env(macro_obj, "TangoSnapshotTTL", SNAPSHOT_TTL))
+
+
+def _get_deadline(macro_obj):
+    """Deadline of DsTimeout seconds (environment variable, no deadline if
+    it is not defined)"""
+    return Deadline(_get_env(macro_obj, "DsTimeout"))
+
+
+def _run_server(action, starter, server):
+    """Run the action on a server of a starter, return True if it
+    succeeded"""
+    messages = ACTIONS[action](starter, server["name"])
+    while True:
+        try:
+            message = next(messages)
+        except StopIteration as stop:
+            return stop.value
+        level = LOG_LEVELS.get(message["level"], logging.INFO)
+        tangoctl.log.log(level, "%s: %s", starter.name, message["text"])
+
+
+def run_servers(macro_obj, servers, action, reverse=False, deadline=None):
+    """
+    Run the action (start or stop) on the servers controlled by the
+    starters. The levels are done one after the other (in reverse order if
+    reverse is True) and all the servers of a level in parallel.
+
+    The progress is logged in the tangoctl logger. The deadline of the whole
+    action is the given one or, if None, the environment variable DsTimeout
+    in seconds (no deadline if it is not defined).
+    """
+    if deadline is None:
+        deadline = _get_deadline(macro_obj)
+    levels = tangoctl.find_starters_levels_for_filtered_servers(
+        server_name=servers, filter_func=lambda s: s["level"] > 0)
+    failed = []
+    for level in sorted(levels, reverse=reverse):
+        groups = levels[level]
+        level_servers = [(starter, server)
+                         for starter, host_servers in groups.items()
+                         for server in host_servers]
+        tangoctl.log.info("%s level %d (%d server(s) on %d host(s))",
+                          action, level, len(level_servers), len(groups))
+        tasks = [gevent.spawn(_run_server, action, starter, server)
+                 for starter, server in level_servers]
+        try:
+            while not all(task.ready() for task in tasks):
+                if deadline.expired:
+                    raise TimeoutError("Timeout: the servers did not {0} "
+                                       "on time".format(action))
+                macro_obj.checkPoint()
+                gevent.joinall(tasks, timeout=deadline.period(CHECK_PERIOD))
+        finally:
+            gevent.killall(tasks)
+        for (starter, server), task in zip(level_servers, tasks):
+            if task.exception is not None:
+                tangoctl.log.error("%s: failed to %s %s: %s", starter.name,
+                                   action, server["name"], task.exception)
+            if task.exception is not None or not task.value:
+                failed.append("{0} ({1})".format(server["name"],
+                                                 starter.name))
+    if failed:
+        raise RuntimeError("Failed to {0} {1}".format(
+            action, ", ".join(failed)))
 
 
 @macro([Servers])
 def ds_start(self, servers):
-    """Start the device server(s)"""
+    """Start the device server(s). The servers are started in parallel,
+    level by level."""
     with log_output(self):
-        tangoctl.starter_start_servers(server_name=servers)
+        run_servers(self, servers, "start")
 
 
 @macro([Servers])
 def ds_stop(self, servers):
-    """Stop the device server(s)"""
+    """Stop the device server(s). The servers are stopped in parallel, level
+    by level (from the highest level)."""
     with log_output(self):
-        tangoctl.starter_stop_servers(server_name=servers)
+        run_servers(self, servers, "stop", reverse=True)
 
 
 @macro([Servers])
 def ds_restart(self, servers):
-    """Restart the device server(s)"""
+    """Restart the device server(s). All the servers are stopped (from the
+    highest level) and then started (from the lowest level), the servers of
+    a level in parallel."""
+    deadline = _get_deadline(self)
     with log_output(self):
-        tangoctl.starter_restart_servers(server_name=servers)
+        run_servers(self, servers, "stop", reverse=True, deadline=deadline)
+        run_servers(self, servers, "start", deadline=deadline)
+
+
+def build_server_tree(snapshot, servers=None):
+    """Build the tree of servers (like tangoctl.server_tree) from the
+    snapshot"""
+    db_info = snapshot.db_info
+    match = compile_patterns(servers)
+    tree = treelib.Tree()
+    db_node = tree.create_node(db_info.name)
+    # group servers by type
+    serv_map = collections.defaultdict(dict)
+    for serv in db_info.servers.values():
+        if match(serv.name):
+            serv_map[serv.type][serv.instance] = serv
+    for serv_type in sorted(serv_map):
+        instances = serv_map[serv_type]
+        serv_type_node = tree.create_node(serv_type, parent=db_node)
+        for serv_inst in sorted(instances):
+            serv = instances[serv_inst]
+            serv_inst_node = tree.create_node(serv_inst,
+                                              parent=serv_type_node)
+            for device in sorted(serv.devices):
+                dlower = device.lower()
+                if dlower.startswith("dserver/"):
+                    continue
+                device_info = db_info.devices[dlower]
+                text = "{} ({})".format(device, device_info.klass)
+                tree.create_node(text, parent=serv_inst_node)
+    return tree
+
+
+STATE_COLORS = {"ON": "green", "FAULT": "red", "MOVING": "blue"}
+
+
+def build_starter_tree(snapshot, servers=None):
+    """Build the tree of starters (like tangoctl.starter_tree) from the
+    snapshot"""
+    match = compile_patterns(servers)
+    tree = treelib.Tree()
+    db_node = tree.create_node(snapshot.db_info.name)
+    starters = snapshot.starters
+    for starter in sorted(starters, key=lambda s: s.name):
+        starter_servers = starters[starter]
+        fg = "red" if starter_servers is None else "green"
+        starter_node = tree.create_node(click.style(starter.name, fg=fg),
+                                        parent=db_node)
+        level_servers = collections.defaultdict(list)
+        for server in (starter_servers or {}).values():
+            if match(server["info"].name):
+                level_servers[server["level"]].append(server)
+        for level in sorted(level_servers):
+            if level == 0:
+                continue
+            level_node = tree.create_node("level {}".format(level),
+                                          parent=starter_node)
+            for server in level_servers[level]:
+                color = STATE_COLORS.get(server["state"], "magenta")
+                tree.create_node(click.style(server["name"], fg=color),
+                                 parent=level_node)
+    return tree
+
+
+def _output_tree(macro_obj, tree):
+    text = tree.show(line_type="ascii", stdout=False)
+    for line in text.split("\n"):
+        macro_obj.output(line)
 
 
 @macro([OptionalServers])
@@ -59,13 +243,13 @@ def ds_tree(self, servers):
     +-- WebTornadoDS
         +-- vacuum
             +-- web/tornado/vacuum (WebTornadoDS4Impl)
+
+    The servers are read from a snapshot of the database which is updated
+    every TangoSnapshotTTL seconds (60 by default) or with tango_refresh.
     """
     if servers == [None]:
         servers = None
-    tree = tangoctl.server_tree(server_name=servers)
-    text = tree.show(line_type="ascii", stdout=False)
-    for line in text.split("\n"):
-        self.output(line)
+    _output_tree(self, build_server_tree(_get_snapshot(self), servers))
 
 
 @macro([OptionalServers])
@@ -84,13 +268,24 @@ def starter_tree(self, servers):
     |       +-- TangoTest/tcoutinho2
     |-- ibl1301
     +-- ibl1302
+
+    The starters are read from a snapshot of the database which is updated
+    every TangoSnapshotTTL seconds (60 by default) or with tango_refresh.
+    The states of the servers are always asked to the starters.
     """
     if servers == [None]:
         servers = None
-    tree = tangoctl.starter_tree(server_name=servers)
-    text = tree.show(line_type="ascii", stdout=False)
-    for line in text.split("\n"):
-        self.output(line)
+    _output_tree(self, build_starter_tree(_get_snapshot(self), servers))
+
+
+@macro()
+def tango_refresh(self):
+    """Read again the Tango database used by ds_tree and starter_tree"""
+    snapshot = _get_snapshot(self)
+    snapshot.refresh()
+    db_info = snapshot.db_info
+    self.output("{0}: {1} servers, {2} devices".format(
+        db_info.name, len(db_info.servers), len(db_info.devices)))
 
 
 startDS = ds_start
@@ -1,54 +1,110 @@
 import time
+from concurrent.futures import ThreadPoolExecutor
+
 from sardana.macroserver.macro import Macro, Type
-import PyTango
+
+from sardana_alba.macro.util.deadline import Deadline, sleep_until
+from sardana_alba.macro.util.monitor import get_attribute_monitor, \
+    get_device_monitor
 
 
 class dwell(Macro):
     """
     This macro waits for a time amount specified by dtime parameter.
     (python: time.sleep(dtime))
+
+    The end of the wait is a fixed (monotonic) deadline, so the time spent
+    checking if the macro was aborted does not add up to the dwell time.
     """
 
     param_def = [
-       ['dtime', Type.Float, None, 'Dwell time in seconds']
+       ['dtime', Type.Float, None, 'Dwell time in seconds'],
+       ['report', Type.Boolean, False, 'Show the actual elapsed time']
     ]
 
-    def run(self, dtime):
-        while dtime > 0:
-            self.checkPoint()
-
-            if dtime > 1:
-                time.sleep(1)
-                dtime = dtime - 1
-            else:
-                time.sleep(dtime)
-                dtime = 0
+    def run(self, dtime, report):
+        elapsed = sleep_until(Deadline(dtime), self.checkPoint)
+        if report:
+            self.output('Dwell time: {0:.6f} s (requested {1:.6f} s)'.format(
+                elapsed, dtime))
 
 
 class set_user_pos_pm(Macro):
     """
     This macro set the position of a pseudomotor by changing the offset of its
     motors.
+
+    The pseudomotor tree is resolved once to compute the new user position of
+    all its physical motors, then the offsets (and user limits, as
+    set_user_pos does) of all of them are changed at the same time. With
+    dry_run the new offsets are only shown.
     """
 
     param_def = [['pm', Type.PseudoMotor, None, 'Pseudo motor name'],
-                 ['pos', Type.Float, None, 'Position which will set']]
-
-    def set_pos(self, moveable, pos):
+                 ['pos', Type.Float, None, 'Position which will set'],
+                 ['dry_run', Type.Boolean, False, 'Show the new offsets '
+                                                  'without applying them']]
+
+    def _get_moveable(self, name):
+        moveable = self._moveables.get(name)
+        if moveable is None:
+            moveable = self.getMoveable(name)
+            self._moveables[name] = moveable
+        return moveable
+
+    def _resolve(self, moveable, pos, targets):
+        """Fill targets with the user position of every physical motor
+        of the moveable, by motor name."""
         moveable_type = moveable.getType()
         if moveable_type == "PseudoMotor":
-            moveables_names = moveable.elements
             values = moveable.CalcPhysical(pos)
-            sub_moveables = [(self.getMoveable(name), value)
-                             for name, value in zip(moveables_names, values)]
-            for sub_moveable, value in sub_moveables:
-                self.set_pos(sub_moveable, value)
+            for name, value in zip(moveable.elements, values):
+                self._resolve(self._get_moveable(name), value, targets)
         elif moveable_type == "Motor":
-            m = moveable.getName()
-            self.execMacro('set_user_pos %s %f' % (m, pos))
-
-    def run(self, pm, pos):
-        self.set_pos(pm, pos)
+            name = moveable.getName()
+            if name in targets and targets[name][1] != pos:
+                raise ValueError('Motor {0} needs two different positions '
+                                 '({1} and {2})'.format(name, targets[name][1],
+                                                        pos))
+            targets[name] = (moveable, pos)
+
+    @staticmethod
+    def _plan(motor, pos):
+        """Read the motor and compute its new offset and user limits"""
+        old_pos = motor.getPosition(force=True)
+        old_offset = motor.getAttribute('Offset').read().rvalue.magnitude
+        pos_obj = motor.getPositionObj()
+        shift = pos - old_pos
+        return {'motor': motor, 'old_pos': old_pos, 'old_offset': old_offset,
+                'pos': pos, 'offset': old_offset + shift,
+                'low': pos_obj.getMinRange().magnitude + shift,
+                'high': pos_obj.getMaxRange().magnitude + shift}
+
+    @staticmethod
+    def _apply(plan):
+        motor = plan['motor']
+        motor.getAttribute('Offset').write(plan['offset'])
+        motor.getPositionObj().setLimits(plan['low'], plan['high'])
+
+    def run(self, pm, pos, dry_run):
+        self._moveables = {}
+        targets = {}
+        self._resolve(pm, pos, targets)
+
+        with ThreadPoolExecutor(max_workers=max(1, len(targets))) as executor:
+            plans = list(executor.map(lambda target: self._plan(*target),
+                                      targets.values()))
+            if not dry_run:
+                # consume the results to raise the errors
+                list(executor.map(self._apply, plans))
+
+        for plan in plans:
+            self.output('%s reset from %.4f (offset %.4f) to %.4f '
+                        '(offset %.4f)' % (plan['motor'].getName(),
+                                           plan['old_pos'], plan['old_offset'],
+                                           plan['pos'], plan['offset']))
+        if dry_run:
+            self.output('Dry run: nothing was changed')
 
 
 ###############################################################################
@@ -66,7 +122,10 @@ class PSHU(object):
         try:
             sh_attr_name = self.getEnv('PshuAttr')
             self.sh_timeout = self.getEnv('PshuTimeout')
-            self.attr = PyTango.AttributeProxy(sh_attr_name)
+            # the monitor (proxy and event subscription) is shared by all
+            # the macros of the MacroServer
+            self.sh_monitor, self.sh_attr = get_attribute_monitor(
+                sh_attr_name)
 
         except Exception as e:
             msg = 'The macro use the environment variable PshuAttr which ' \
@@ -77,36 +136,35 @@ class PSHU(object):
 
     @property
     def state(self):
-        return self.attr.read().value
+        return self.sh_monitor.read()[self.sh_attr]
 
     def _writeValue(self, value):
-        self.attr.write(value)
-        t1 = time.time()
+        self.sh_monitor.write(self.sh_attr, value)
         msg_to = 'Timeout Error: Could not open the photon shutter'
         if value == self.CLOSE_VALUE:
             msg_to = 'Timeout Error: Could not close the photon shutter'
-        while self.state != value:
-            t = time.time() - t1
-            if t > self.sh_timeout:
-                raise RuntimeError(msg_to)
-            time.sleep(0.1)
-            self.checkPoint()
+        try:
+            return self.sh_monitor.wait_for(
+                lambda values: values[self.sh_attr] == value,
+                self.sh_timeout, self.checkPoint)
+        except TimeoutError:
+            raise RuntimeError(msg_to)
 
     def open(self):
         if self.state:
             self.info('The photon shutter was open')
             return
         self.info('Opening photon shutter...')
-        self._writeValue(self.OPEN_VALUE)
-        self.info('The photon shutter is open')
+        latency = self._writeValue(self.OPEN_VALUE)
+        self.info('The photon shutter is open ({:.3f} s)'.format(latency))
 
     def close(self):
         if not self.state:
             self.info('The photon shutter was closed')
             return
         self.info('Closing photon shutter...')
-        self._writeValue(self.CLOSE_VALUE)
-        self.info('The photon shutter is closed')
+        latency = self._writeValue(self.CLOSE_VALUE)
+        self.info('The photon shutter is closed ({:.3f} s)'.format(latency))
 
 
 class shopen(Macro, PSHU):
@@ -173,7 +231,12 @@ class FrontEnd(object):
         try:
             eps_name = self.getEnv('EPSName')
             self.fe_timeout = self.getEnv('FeTimeout')
-            self.eps = PyTango.DeviceProxy(eps_name)
+            # the monitor (proxy and event subscriptions) is shared by all
+            # the macros of the MacroServer
+            self.fe_monitor = get_device_monitor(
+                eps_name, [self.FE_OPEN_ATTR, self.BL_READY,
+                           self.FE_CTRL_ATTR, self.FE_AUTO_ATTR])
+            self.eps = self.fe_monitor.device
 
         except Exception as e:
             msg = 'The macro use the environment variable EPSName which has ' \
@@ -183,59 +246,58 @@ class FrontEnd(object):
             raise RuntimeError(msg)
 
     def is_bl_ready(self):
-        return bool(self.eps.read_attribute(self.BL_READY).value)
+        return bool(self.fe_monitor.read()[self.BL_READY])
 
     def is_fe_open(self):
-        return bool(self.eps.read_attribute(self.FE_OPEN_ATTR).value)
+        return bool(self.fe_monitor.read()[self.FE_OPEN_ATTR])
 
     def is_fe_close(self):
         return not self.is_fe_open()
 
     def is_fe_ctr_disabled(self):
-        return bool(self.eps.read_attribute(self.FE_CTRL_ATTR).value)
+        return bool(self.fe_monitor.read()[self.FE_CTRL_ATTR])
 
     # def is_fe_pss_permits(self):
     #     return bool(self.eps.read_attribute(self.))
 
     def is_fe_auto(self):
-        return bool(self.eps.read_attribute(self.FE_AUTO_ATTR).value)
+        return bool(self.fe_monitor.read()[self.FE_AUTO_ATTR])
 
     def _write_value(self, value):
         if value == self.CLOSE:
             attr = self.FE_CLOSE_ATTR
-            is_ready = self.is_fe_close
+            expected = False
         else:
             attr = self.FE_OPEN_ATTR_W
-            is_ready = self.is_fe_open
+            expected = True
 
         self.eps.write_attribute(attr, True)
-        t1 = time.time()
         msg_to = 'Timeout Error: Could not open the Front End.\n'
         if value == self.CLOSE:
             msg_to = 'Timeout Error: Could not close the Front End.\n'
-        while not is_ready():
-            t = time.time() - t1
-            if t > self.fe_timeout:
-                msg_to += 'Run macro festatus to see the status'
-                raise RuntimeError(msg_to)
-            time.sleep(0.1)
-            self.checkPoint()
+        try:
+            return self.fe_monitor.wait_for(
+                lambda values: bool(values[self.FE_OPEN_ATTR]) == expected,
+                self.fe_timeout, self.checkPoint)
+        except TimeoutError:
+            msg_to += 'Run macro festatus to see the status'
+            raise RuntimeError(msg_to)
 
     def fe_close(self):
         if self.is_fe_close():
             self.info('The Front End was closed')
             return
         self.info('Closing Front End...')
-        self._write_value(self.CLOSE)
-        self.info('FE is closed.')
+        latency = self._write_value(self.CLOSE)
+        self.info('FE is closed ({:.3f} s).'.format(latency))
 
     def fe_open(self):
         if self.is_fe_open():
             self.info('The Front End was open')
             return
         self.info('Opening Front End...')
-        self._write_value(self.OPEN)
-        self.info('FE is open.')
+        latency = self._write_value(self.OPEN)
+        self.info('FE is open ({:.3f} s).'.format(latency))
 
     def fe_auto(self, value=None):
         if value is not None:
@@ -250,11 +312,12 @@ class FrontEnd(object):
 
     def fe_status(self):
         flg_warn = False
+        values = self.fe_monitor.read()
 
         # FE state
         msg = 'open'
         stream = self.info
-        if not self.is_fe_open():
+        if not values[self.FE_OPEN_ATTR]:
             msg = 'close'
             stream = self.warning
             flg_warn = True
@@ -263,7 +326,7 @@ class FrontEnd(object):
         # BL state
         msg = 'is'
         stream = self.info
-        if not self.is_bl_ready():
+        if not values[self.BL_READY]:
             msg = 'is not'
             stream = self.warning
             flg_warn = True
@@ -272,7 +335,7 @@ class FrontEnd(object):
         # FE control room permits
         msg = 'has'
         stream = self.info
-        if self.is_fe_ctr_disabled():
+        if values[self.FE_CTRL_ATTR]:
             msg = 'has not'
             stream = self.warning
             flg_warn = True
@@ -291,9 +354,8 @@ class FrontEnd(object):
             raise RuntimeError(msg)
 
         self.info('Waiting for opening the Front End')
-        while self.is_fe_close():
-            time.sleep(0.1)
-            self.checkPoint()
+        self.fe_monitor.wait_for(lambda values: values[self.FE_OPEN_ATTR],
+                                 None, self.checkPoint)
 
 
 class feclose(Macro, FrontEnd):
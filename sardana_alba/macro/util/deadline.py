@@ -0,0 +1,77 @@
+"""
+Waits based on a monotonic deadline
+
+The remaining time is always computed from the deadline, so the overhead of
+every step of a wait loop (e.g. the macro checkPoint) does not accumulate,
+and the waits are not affected by changes of the system clock.
+
+Example::
+
+    from sardana_alba.macro.util.deadline import Deadline, sleep_until
+
+    deadline = Deadline(10)
+    elapsed = sleep_until(deadline, check_point=self.checkPoint)
+"""
+
+import time
+
+__all__ = ['Deadline', 'sleep_until']
+
+#: maximum time sleeping before calling the check point
+CHECK_PERIOD = 0.1
+#: the last part of the wait is done without sleeping, for a
+#: sub-millisecond accuracy
+SPIN_TIME = 0.002
+
+
+class Deadline(object):
+    """Deadline of a wait, timeout None for a deadline which never
+    expires"""
+
+    def __init__(self, timeout=None):
+        self.start = time.monotonic()
+        if timeout is None:
+            self.end = float('inf')
+        else:
+            self.end = self.start + timeout
+
+    @property
+    def elapsed(self):
+        """Time since the creation of the deadline in seconds"""
+        return time.monotonic() - self.start
+
+    @property
+    def remaining(self):
+        """Time until the deadline in seconds (negative once expired)"""
+        return self.end - time.monotonic()
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.end
+
+    def period(self, max_period):
+        """Time to wait in the next step of a wait loop: max_period, or the
+        remaining time if the deadline is closer (never negative)."""
+        return max(0.0, min(max_period, self.remaining))
+
+
+def sleep_until(deadline, check_point=None, period=CHECK_PERIOD):
+    """Sleep until the deadline, calling the check point at least every
+    period seconds.
+
+    :param deadline: (Deadline) deadline to wait for
+    :param check_point: (callable) called periodically while waiting
+        (e.g. the macro checkPoint, to allow aborting it)
+    :param period: (float) maximum time between check points in seconds.
+        The check point is not called in the last milliseconds of the wait.
+
+    :return: (float) the time elapsed since the creation of the deadline"""
+    while True:
+        remaining = deadline.remaining
+        if remaining <= 0:
+            break
+        if remaining > SPIN_TIME:
+            if check_point is not None:
+                check_point()
+            time.sleep(max(0.0, min(period, deadline.remaining - SPIN_TIME)))
+    return deadline.elapsed
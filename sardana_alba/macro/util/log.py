@@ -16,9 +16,17 @@ Example::
            ...
            logger.info("started doing stuff")
            ...
+
+BufferedMacroOutputLogHandler does not block the logging code: the records
+are queued and written to the macro output by a background thread, several
+of them in each output, at most every ``period`` seconds.
 """
 
+import collections
 import logging
+import queue
+import threading
+import time
 
 
 class MacroOutputLogHandler(logging.Handler):
@@ -39,3 +47,111 @@ class MacroOutputLogHandler(logging.Handler):
     def emit(self, record):
         self.macro.output(self.format(record))
 
+
+class BufferedMacroOutputLogHandler(MacroOutputLogHandler):
+    """
+    MacroOutputLogHandler which queues the records and writes them to the
+    macro output from a background thread, joined in a single output every
+    period seconds.
+
+    Records are dropped (and counted) when the queue is full or when more
+    than max_rate records per second are logged. The last history records
+    are kept, dropped or not, e.g. to report them after an error.
+    """
+
+    def __init__(self, macro, logger=logging.root, level=logging.NOTSET,
+                 period=0.1, max_rate=None, queue_size=10000, history=100):
+        """
+        :param period: (float) time between outputs in seconds
+        :param max_rate: (float) maximum records per second, None for no
+            limit
+        :param queue_size: (int) maximum records waiting to be written
+        :param history: (int) number of last records kept
+        """
+        super().__init__(macro, logger=logger, level=level)
+        self.period = period
+        self.max_rate = max_rate
+        #: number of records which were not written
+        self.dropped = 0
+        #: last formatted records
+        self.history = collections.deque(maxlen=history)
+        self._queue = queue.Queue(queue_size)
+        self._reported_dropped = 0
+        self._tokens = max_rate
+        self._tokens_time = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='MacroOutputLogFlusher')
+        self._thread.start()
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        super().__exit__(exc_type, exc_value, tb)
+        self._stop.set()
+        self._thread.join()
+        try:
+            self.flush()
+        except Exception:
+            # do not hide the exception of the macro (e.g. it was stopped
+            # or aborted and it cannot output anymore)
+            if exc_type is None:
+                raise
+
+    def _allowed(self):
+        """Token bucket rate limit, max_rate tokens per second"""
+        if self.max_rate is None:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.max_rate, self._tokens +
+                           (now - self._tokens_time) * self.max_rate)
+        self._tokens_time = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self.lock:
+            self.history.append(msg)
+            if not self._allowed():
+                self.dropped += 1
+                return
+        try:
+            self._queue.put_nowait(msg)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def flush(self):
+        """Write all the queued records in a single output"""
+        lines = []
+        while True:
+            try:
+                lines.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self.lock:
+            dropped = self.dropped - self._reported_dropped
+            self._reported_dropped = self.dropped
+        if dropped:
+            lines.append('({0} log message(s) dropped)'.format(dropped))
+        if lines:
+            self.macro.output('\n'.join(lines))
+
+    def _run(self):
+        while not self._stop.wait(self.period):
+            try:
+                self.flush()
+            except Exception:
+                # the macro cannot output anymore (e.g. it was stopped or
+                # aborted), the error is seen by the macro itself
+                return
@@ -0,0 +1,138 @@
+"""
+Semantic comparison of measurement group configurations
+
+The configurations are compared by meaning instead of as JSON strings:
+all the settings of the measurement group, its controllers and its channels
+are compared key by key, so two configurations written with a different key
+order or formatting are the same. The settings which are usually changed by
+the users (see MG_KEYS, CTRL_KEYS and CHANNEL_KEYS) are reported first and
+flagged as ``reported``, the other ones can be summarized.
+
+Example::
+
+    from sardana_alba.macro.util.mntgrp_config import diff_configs, \\
+        patch_config
+
+    changes, same_channels = diff_configs(current, backup)
+    for change in changes:
+        print(change)
+    if same_channels:
+        config = patch_config(current, changes)
+"""
+
+import json
+
+__all__ = ['ConfigChange', 'diff_configs', 'patch_config']
+
+#: keys with the nested controllers and channels (not settings)
+NESTED_KEYS = ('controllers', 'channels')
+#: settings of the measurement group reported one by one
+MG_KEYS = ('timer', 'monitor')
+#: settings of each controller reported one by one
+CTRL_KEYS = ('timer', 'monitor', 'synchronizer', 'synchronization')
+#: settings of each channel reported one by one
+CHANNEL_KEYS = ('enabled', 'plot_type', 'plot_axes', 'output',
+                'value_ref_enabled', 'value_ref_pattern')
+
+
+class ConfigChange(object):
+    """A setting which is different in two configurations"""
+
+    def __init__(self, ctrl, channel, key, old, new, name=None,
+                 reported=True):
+        #: controller full name (None for a measurement group setting)
+        self.ctrl = ctrl
+        #: channel full name (None for a controller setting)
+        self.channel = channel
+        self.key = key
+        self.old = old
+        self.new = new
+        #: name of the element shown to the users
+        self.name = name
+        #: True if it is one of the settings reported one by one
+        self.reported = reported
+
+    @property
+    def element(self):
+        if self.name is not None:
+            return self.name
+        if self.channel is not None:
+            return self.channel
+        if self.ctrl is not None:
+            return self.ctrl
+        return 'measurement group'
+
+    def __repr__(self):
+        return '{0} {1}: {2!r} -> {3!r}'.format(self.element, self.key,
+                                                self.old, self.new)
+
+
+def _as_dict(config):
+    if isinstance(config, str):
+        return json.loads(config)
+    return config
+
+
+def _diff_keys(old, new, keys, ctrl, channel, changes):
+    """Compare all the settings of two dictionaries, the keys first"""
+    name = new.get('name') if channel is not None else None
+    others = sorted((set(old) | set(new)) - set(keys) - set(NESTED_KEYS))
+    for key in list(keys) + others:
+        if old.get(key) != new.get(key):
+            changes.append(ConfigChange(ctrl, channel, key, old.get(key),
+                                        new.get(key), name,
+                                        reported=key in keys))
+
+
+def diff_configs(old, new):
+    """Compare two measurement group configurations.
+
+    :param old: (str or dict) configuration, e.g. the current one
+    :param new: (str or dict) configuration, e.g. the backup
+
+    :return: (tuple<list<ConfigChange>, bool>) the changed settings and
+        True if both configurations have the same controllers and channels
+        (otherwise the changes only cover the common ones)"""
+    old, new = _as_dict(old), _as_dict(new)
+    changes = []
+    _diff_keys(old, new, MG_KEYS, None, None, changes)
+    old_ctrls = old.get('controllers', {})
+    new_ctrls = new.get('controllers', {})
+    same_channels = set(old_ctrls) == set(new_ctrls)
+    for ctrl in old_ctrls:
+        if ctrl not in new_ctrls:
+            continue
+        old_ctrl, new_ctrl = old_ctrls[ctrl], new_ctrls[ctrl]
+        _diff_keys(old_ctrl, new_ctrl, CTRL_KEYS, ctrl, None, changes)
+        old_channels = old_ctrl.get('channels', {})
+        new_channels = new_ctrl.get('channels', {})
+        if set(old_channels) != set(new_channels):
+            same_channels = False
+        for channel in old_channels:
+            if channel in new_channels:
+                _diff_keys(old_channels[channel], new_channels[channel],
+                           CHANNEL_KEYS, ctrl, channel, changes)
+    return changes, same_channels
+
+
+def patch_config(config, changes):
+    """Apply the changes to a configuration.
+
+    :param config: (str or dict) configuration to change
+    :param changes: (list<ConfigChange>) changes from diff_configs
+
+    :return: (str) the changed configuration as JSON"""
+    config = _as_dict(config)
+    for change in changes:
+        if change.ctrl is None:
+            settings = config
+        elif change.channel is None:
+            settings = config['controllers'][change.ctrl]
+        else:
+            settings = \
+                config['controllers'][change.ctrl]['channels'][change.channel]
+        if change.new is None:
+            settings.pop(change.key, None)
+        else:
+            settings[change.key] = change.new
+    return json.dumps(config)
@@ -0,0 +1,207 @@
+"""
+History of measurement group configurations
+
+The configurations are stored in a directory as content addressed blobs:
+gzip-compressed JSON files named by the SHA-1 of the (normalized)
+configuration, so a configuration which was already saved takes no extra
+space. An append-only index (``index.jsonl``) has one line per revision with
+the measurement group name, the time and the hash of its configuration.
+
+Saving a configuration writes at most one blob and appends one line to the
+index, without reading it: a small head file by measurement group
+(``heads/<mg>.json``) has the hash of its last revision and its number of
+revisions. When a measurement group has more than twice ``max_revisions``
+revisions the index is pruned to the last ``max_revisions`` of every
+measurement group and the blobs which are not used anymore are removed, so
+the disk usage is bounded and the cost of pruning is spread over many saves.
+
+Example::
+
+    from sardana_alba.macro.util.mntgrp_history import MntGrpHistory
+
+    history = MntGrpHistory('/beamlines/bl99/mntgrp_history')
+    history.save('mg1', mg.read_attribute('configuration').value)
+    for revision in history.revisions('mg1'):
+        print(revision['id'], revision['date'])
+    config = history.get('mg1', 'a1b2c3')
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import time
+
+__all__ = ['MntGrpHistory', 'normalize_config']
+
+#: default maximum number of revisions kept by measurement group
+MAX_REVISIONS = 200
+#: number of characters of the hash used as revision id
+ID_LENGTH = 10
+
+
+def normalize_config(config):
+    """Return the configuration as a canonical JSON string (sorted keys, no
+    spaces), so the same configuration always has the same hash.
+
+    :param config: (str or dict) measurement group configuration"""
+    if isinstance(config, str):
+        config = json.loads(config)
+    return json.dumps(config, sort_keys=True, separators=(',', ':'))
+
+
+class MntGrpHistory(object):
+    """Content addressed history of measurement group configurations"""
+
+    INDEX = 'index.jsonl'
+    HEADS = 'heads'
+
+    def __init__(self, path, max_revisions=MAX_REVISIONS):
+        """
+        :param path: (str) directory of the history, created if needed
+        :param max_revisions: (int) revisions kept by measurement group
+            after pruning
+        """
+        self.path = path
+        self.max_revisions = max_revisions
+        self.index_filename = os.path.join(path, self.INDEX)
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(path, self.HEADS), exist_ok=True)
+
+    def _blob_filename(self, digest):
+        return os.path.join(self.path, 'objects', digest[:2],
+                            digest + '.json.gz')
+
+    def _head_filename(self, mg_name):
+        return os.path.join(self.path, self.HEADS, mg_name + '.json')
+
+    def _read_head(self, mg_name):
+        """Hash of the last revision and number of revisions of a
+        measurement group (from the index if there is no head file)"""
+        try:
+            with open(self._head_filename(mg_name), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            records = [r for r in self._read_index() if r['mg'] == mg_name]
+            return {'hash': records[-1]['hash'] if records else None,
+                    'count': len(records)}
+
+    def _write_head(self, mg_name, head):
+        filename = self._head_filename(mg_name)
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(head, f)
+        os.replace(tmp_filename, filename)
+
+    def _read_index(self):
+        if not os.path.exists(self.index_filename):
+            return []
+        with open(self.index_filename, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _write_index(self, records):
+        tmp_filename = self.index_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        os.replace(tmp_filename, self.index_filename)
+
+    @staticmethod
+    def _revision(record):
+        return dict(record, id=record['hash'][:ID_LENGTH],
+                    date=time.strftime('%Y-%m-%d %H:%M:%S',
+                                       time.localtime(record['time'])))
+
+    def save(self, mg_name, config):
+        """Add a revision of the measurement group configuration. Nothing is
+        added if it is the same as the last revision.
+
+        :param mg_name: (str) measurement group name
+        :param config: (str or dict) measurement group configuration
+
+        :return: (tuple<str, bool>) the revision id and True if a new
+            revision was added"""
+        mg_name = mg_name.lower()
+        data = normalize_config(config).encode()
+        digest = hashlib.sha1(data).hexdigest()
+        head = self._read_head(mg_name)
+        if head['hash'] == digest:
+            return digest[:ID_LENGTH], False
+
+        blob_filename = self._blob_filename(digest)
+        if not os.path.exists(blob_filename):
+            os.makedirs(os.path.dirname(blob_filename), exist_ok=True)
+            tmp_filename = blob_filename + '.tmp'
+            with gzip.open(tmp_filename, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_filename, blob_filename)
+
+        record = {'mg': mg_name, 'time': time.time(), 'hash': digest}
+        with open(self.index_filename, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        head = {'hash': digest, 'count': head['count'] + 1}
+        self._write_head(mg_name, head)
+        if head['count'] > 2 * self.max_revisions:
+            self.prune()
+        return digest[:ID_LENGTH], True
+
+    def revisions(self, mg_name=None):
+        """Return the revisions, from the oldest to the newest, as
+        dictionaries with the keys mg, time, date, hash and id.
+
+        :param mg_name: (str) measurement group name, None for all of them"""
+        records = self._read_index()
+        if mg_name is not None:
+            records = [r for r in records if r['mg'] == mg_name.lower()]
+        return [self._revision(r) for r in records]
+
+    def get_revision(self, mg_name, revision_id):
+        """Return the revision of a measurement group given its id (or any
+        unique prefix of its hash). An empty id is the last revision."""
+        revisions = self.revisions(mg_name)
+        if not revisions:
+            raise ValueError('There is no history of {0}'.format(mg_name))
+        if not revision_id:
+            return revisions[-1]
+        matches = {r['hash']: r for r in revisions
+                   if r['hash'].startswith(revision_id.lower())}
+        if len(matches) != 1:
+            raise ValueError('{0} revision(s) of {1} match {2!r}'.format(
+                len(matches), mg_name, revision_id))
+        return matches.popitem()[1]
+
+    def get(self, mg_name, revision_id):
+        """Return the configuration (JSON string) of a revision"""
+        revision = self.get_revision(mg_name, revision_id)
+        with gzip.open(self._blob_filename(revision['hash']), 'rb') as f:
+            return f.read().decode()
+
+    def prune(self):
+        """Keep the last max_revisions revisions of every measurement group
+        and remove the blobs which are not used anymore."""
+        records = self._read_index()
+        kept = []
+        counts = {}
+        last_hashes = {}
+        for record in reversed(records):
+            last_hashes.setdefault(record['mg'], record['hash'])
+            count = counts.get(record['mg'], 0)
+            if count < self.max_revisions:
+                kept.append(record)
+                counts[record['mg']] = count + 1
+        kept.reverse()
+        self._write_index(kept)
+        for mg_name, count in counts.items():
+            self._write_head(mg_name, {'hash': last_hashes[mg_name],
+                                       'count': count})
+        used = set(r['hash'] for r in kept)
+        for record in records:
+            digest = record['hash']
+            blob_filename = self._blob_filename(digest)
+            if digest not in used and os.path.exists(blob_filename):
+                os.remove(blob_filename)
+                try:
+                    os.rmdir(os.path.dirname(blob_filename))
+                except OSError:
+                    # the directory has other blobs
+                    pass
@@ -0,0 +1,168 @@
+"""
+Tango device monitors shared by the macros of a MacroServer
+
+A monitor keeps the last values of some attributes of a device up to date
+from their change events, so macros can read them without round trips and
+wait for a value without polling. When the device does not push change
+events the monitor reads all the attributes in one ``read_attributes`` call
+and waits with a fast poll.
+
+Monitors are cached by device and attributes, so all the macros executed in
+the MacroServer share the same proxy and event subscriptions.
+
+Example::
+
+    from sardana_alba.macro.util.monitor import get_device_monitor
+
+    monitor = get_device_monitor('bl99/ct/eps-plc-01', ['pshu'])
+    monitor.write('pshu', 1)
+    elapsed = monitor.wait_for(lambda values: values['pshu'] == 1,
+                               timeout=5, check_point=self.checkPoint)
+"""
+
+import functools
+import threading
+import time
+
+import tango
+
+from sardana_alba.macro.util.deadline import Deadline
+
+__all__ = ['DeviceMonitor', 'get_device_monitor', 'get_attribute_monitor']
+
+
+class DeviceMonitor(object):
+
+    #: period of the read loop used when there are no change events
+    POLL_PERIOD = 0.01
+    #: maximum time waiting for an event before calling the check point
+    CHECK_PERIOD = 0.1
+
+    def __init__(self, device_name, attr_names, use_events=True):
+        # before anything which can fail, __del__ needs it
+        self._event_ids = []
+        self.device = tango.DeviceProxy(device_name)
+        self.attr_names = list(attr_names)
+        self._values = {}
+        self._condition = threading.Condition()
+        if use_events:
+            self._subscribe()
+
+    def __del__(self):
+        self._unsubscribe()
+
+    @property
+    def use_events(self):
+        """True if all the attributes are updated from change events"""
+        return len(self._event_ids) == len(self.attr_names)
+
+    def _subscribe(self):
+        try:
+            for name in self.attr_names:
+                event_id = self.device.subscribe_event(
+                    name, tango.EventType.CHANGE_EVENT,
+                    functools.partial(self._attribute_changed, name))
+                self._event_ids.append(event_id)
+        except tango.DevFailed:
+            self._unsubscribe()
+
+    def _unsubscribe(self):
+        while self._event_ids:
+            try:
+                self.device.unsubscribe_event(self._event_ids.pop())
+            except Exception:
+                pass
+
+    def _attribute_changed(self, name, event):
+        with self._condition:
+            if event.err or event.attr_value is None:
+                self._values.pop(name, None)
+            else:
+                self._values[name] = event.attr_value.value
+            self._condition.notify_all()
+
+    def read(self, force=False):
+        """Return a dictionary with the values of all the attributes. They
+        come from the change events or from a single read_attributes call.
+
+        :param force: (bool) read the attributes even if the events are
+            up to date"""
+        if not force and self.use_events:
+            with self._condition:
+                if len(self._values) == len(self.attr_names):
+                    return dict(self._values)
+        attrs = self.device.read_attributes(self.attr_names)
+        return {name: attr.value
+                for name, attr in zip(self.attr_names, attrs)}
+
+    def write(self, name, value):
+        self.device.write_attribute(name, value)
+
+    def wait_for(self, condition, timeout, check_point=None):
+        """Wait until the attribute values fulfil the condition.
+
+        :param condition: (callable) receives the dictionary of values and
+            returns True when the wait is over
+        :param timeout: (float) maximum time to wait in seconds, None to
+            wait forever
+        :param check_point: (callable) called periodically while waiting
+            (e.g. the macro checkPoint, to allow aborting it)
+
+        :return: (float) the time waited in seconds
+        :raises: TimeoutError if the condition is not fulfilled on time"""
+        deadline = Deadline(timeout)
+        while True:
+            values = self.read()
+            if condition(values):
+                break
+            if deadline.expired:
+                raise TimeoutError('Timeout waiting for %s' %
+                                   self.device.name())
+            if check_point is not None:
+                check_point()
+            complete = False
+            if self.use_events:
+                with self._condition:
+                    complete = len(self._values) == len(self.attr_names)
+                    # do not miss an event received after the read
+                    if complete and self._values == values:
+                        self._condition.wait(
+                            deadline.period(self.CHECK_PERIOD))
+            if not complete:
+                # no events or some of them failed: the values were read
+                time.sleep(deadline.period(self.POLL_PERIOD))
+        return deadline.elapsed
+
+
+_monitors = {}
+_attributes = {}
+_monitors_lock = threading.Lock()
+
+
+def get_device_monitor(device_name, attr_names, use_events=True):
+    """Return the monitor of the given device attributes, creating it only
+    the first time it is requested in the MacroServer."""
+    key = (device_name.lower(), tuple(n.lower() for n in attr_names),
+           use_events)
+    with _monitors_lock:
+        monitor = _monitors.get(key)
+        if monitor is None:
+            monitor = DeviceMonitor(device_name, attr_names, use_events)
+            _monitors[key] = monitor
+    return monitor
+
+
+def get_attribute_monitor(attr_full_name, use_events=True):
+    """Return the monitor of a single attribute given its full name (or
+    alias) and the name of the attribute in the monitor.
+
+    :return: (tuple<DeviceMonitor, str>)"""
+    key = attr_full_name.lower()
+    with _monitors_lock:
+        names = _attributes.get(key)
+        if names is None:
+            attr = tango.AttributeProxy(attr_full_name)
+            names = attr.get_device_proxy().name(), attr.name()
+            _attributes[key] = names
+    device_name, attr_name = names
+    return get_device_monitor(device_name, [attr_name], use_events), attr_name
@@ -1,6 +1,150 @@
+import collections
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import PyTango
 
 
+#: time between the state reads while the motors move
+POLL_PERIOD = 0.05
+
+LIMIT_STOP_CODES = {1: 'Limit+ reached', -1: 'Limit- reached'}
+
+
+def read_motors_attributes(motors, attr_names):
+    """Read the same attributes of several motors. The requests to all the
+    motors are sent before waiting for any reply, so it takes the time of a
+    single read.
+    :param motors: (list) pool motor objects
+    :param attr_names: (list<str>) attribute names
+
+    :return: (list<dict>) attribute values of each motor, by name"""
+    attr_names = list(attr_names)
+    ids = [mot.read_attributes_asynch(attr_names) for mot in motors]
+    values = []
+    for mot, req_id in zip(motors, ids):
+        # timeout 0: wait until the reply arrives
+        attrs = mot.read_attributes_reply(req_id, 0)
+        values.append({name: attr.value
+                       for name, attr in zip(attr_names, attrs)})
+    return values
+
+
+class HomingResult(object):
+    """Result of moving a motor to a hardware limit"""
+
+    def __init__(self, motor, position, limit):
+        self.motor = motor
+        self.name = motor.alias()
+        #: position to approach the limit
+        self.position = position
+        #: 1 for the positive limit, -1 for the negative limit
+        self.limit = 1 if limit > 0 else -1
+        #: sign used to swap the stop codes (1 if not in pool sense)
+        self.sign = 1
+        #: True if the motor was at the limit before moving
+        self.already = False
+        #: True if the motor is at the limit
+        self.reached = False
+        #: StatusStopCode after the motion
+        self.stop_code = None
+        #: time in seconds until the motor stopped, None if it did not move
+        self.elapsed = None
+
+    def __repr__(self):
+        return '{0}: limit {1:+d} reached={2} already={3} ' \
+               'elapsed={4}'.format(self.name, self.limit, self.reached,
+                                    self.already, self.elapsed)
+
+
+def homeToHardLim(macro, groups, use_sign=True):
+    """Move groups of motors to their hardware limits. The motors of a group
+    move together in one motion and all the groups move at the same time.
+    A group with a motor already at its limit is not moved.
+
+    The limit switches, sign and stop codes of all the motors are read with
+    one request per motor, all of them at the same time, and the state of
+    the moving motors is polled the same way to know when each of them
+    stopped.
+    :param macro: macro object which calls this method
+    :param groups: (list) of lists of (mot, pos, lim) tuples (see
+        moveToHardLim)
+    :param use_sign: (bool) limits in pool sense: the stop codes are swapped
+        for motors with negative sign
+
+    :return: (list<HomingResult>) results of all the motors, in the order
+        of the groups"""
+    groups = [[HomingResult(mot, pos, lim) for mot, pos, lim in group]
+              for group in groups]
+    results = [r for group in groups for r in group]
+    attrs = read_motors_attributes([r.motor for r in results],
+                                   ['Limit_switches', 'Sign'])
+    for result, values in zip(results, attrs):
+        # Limit_switches: home, positive limit, negative limit
+        switch = 1 if result.limit > 0 else 2
+        if values['Limit_switches'][switch]:
+            macro.debug('Motor %s is already at the %s limit.', result.name,
+                        ['negative', 'positive'][result.limit > 0])
+            result.already = result.reached = True
+        result.sign = values['Sign'] if use_sign else 1
+
+    moving = [group for group in groups
+              if not any(r.already for r in group)]
+    motions = []
+    try:
+        for group in moving:
+            for result in group:
+                macro.debug('Moving motor %s to position: %f).', result.name,
+                            result.position)
+            motion = macro.getMotion([r.motor for r in group])
+            ids = motion.startMove([r.position for r in group])
+            motions.append((motion, ids))
+        t0 = time.monotonic()
+        pending = [r for group in moving for r in group]
+        while pending:
+            macro.checkPoint()
+            states = read_motors_attributes([r.motor for r in pending],
+                                            ['State'])
+            now = time.monotonic()
+            for result, values in zip(pending, states):
+                if values['State'] != PyTango.DevState.MOVING:
+                    result.elapsed = now - t0
+            pending = [r for r in pending if r.elapsed is None]
+            if pending:
+                time.sleep(POLL_PERIOD)
+        for motion, ids in motions:
+            motion.waitMove(id=ids)
+        macro.checkPoint()
+
+        # Checking stop code (if we reached the limits)
+        moved = [r for group in moving for r in group]
+        attrs = read_motors_attributes([r.motor for r in moved],
+                                       ['StatusStopCode'])
+        for result, values in zip(moved, attrs):
+            result.stop_code = values['StatusStopCode']
+            # here we are swapping status stop codes to consider pool sense
+            expected = LIMIT_STOP_CODES[result.limit * result.sign]
+            if result.stop_code == expected:
+                macro.debug('Motor %s reached its %s limit.', result.name,
+                            ['negative', 'positive'][result.limit > 0])
+                result.reached = True
+    except PyTango.DevFailed as e:
+        macro.error(repr(e))
+        macro.error('Moving motors: %s was interupted.',
+                    repr([r.name for r in results]))
+        raise e
+    return results
+
+
+def _limit_reached(results):
+    """Motors already at the limit if there are, otherwise the motors which
+    reached it (as the original homing functions)"""
+    already = [r for r in results if r.already]
+    if already:
+        return already
+    return [r for r in results if r.reached]
+
+
 def moveToHardLim(macro, info_list):
     """From following information: motor, position to approach the limit, and
     limit (all in pool sense) it tries to reach specified limit and return list
@@ -14,151 +158,60 @@ def moveToHardLim(macro, info_list):
                 negative - negative limit)
 
     :return: (list) list of motor names which reached hardware limit"""
-    try:
-        motors = [x[0] for x in info_list]
-        positions = [x[1] for x in info_list]
-        limits = [x[2] for x in info_list]
-        # Checking limits state (maybe they were already active)
-        motorsOnLim = []
-        for mot, lim in zip(motors, limits):
-            mot_alias = mot.alias()
-            if lim > 0:
-                if mot.Limit_switches[1]:
-                    macro.debug(
-                        'Motor %s is already at the positive limit.',
-                        mot_alias)
-                    motorsOnLim.append(mot_alias)
-            elif lim < 0:
-                if mot.Limit_switches[2]:
-                    macro.debug(
-                        'Motor %s is already at the negative limit.',
-                        mot_alias)
-                    motorsOnLim.append(mot_alias)
-        if len(motorsOnLim):
-            return motorsOnLim
-
-        for mot, pos in zip(motors, positions):
-            macro.debug('Moving motor %s to position: %f).', mot.alias(), pos)
-        motion = macro.getMotion(motors)
-        motion.move(positions)
-        macro.checkPoint()
-        # Checking stop code (if we reached positive limits)
-        motorsWhichReachedLim = []
-        for mot, lim in zip(motors, limits):
-            mot_alias = mot.alias()
-            macro.debug("Alias %s", mot_alias)
-            if mot.Sign > 0:
-                if lim > 0 and mot.StatusStopCode == 'Limit+ reached':
-                    macro.debug(
-                        'Motor %s reached its positive limit.', mot_alias)
-                    motorsWhichReachedLim.append(mot_alias)
-                if lim < 0 and mot.StatusStopCode == 'Limit- reached':
-                    macro.debug(
-                        'Motor %s reached its negative limit.', mot_alias)
-                    motorsWhichReachedLim.append(mot_alias)
-            # here we are swapping status stop codes to consider pool sense
-            if mot.Sign < 0:
-                if lim > 0 and mot.StatusStopCode == 'Limit- reached':
-                    macro.debug(
-                        'Motor %s reached its positive limit.', mot_alias)
-                    motorsWhichReachedLim.append(mot_alias)
-                if lim < 0 and mot.StatusStopCode == 'Limit+ reached':
-                    macro.debug(
-                        'Motor %s reached its negative limit.', mot_alias)
-                    motorsWhichReachedLim.append(mot_alias)
-        return motorsWhichReachedLim
-    except PyTango.DevFailed as e:
-        macro.error(repr(e))
-        macro.error('Moving motors: %s was interupted.', repr(motors))
-        raise e
+    results = homeToHardLim(macro, [info_list])
+    return [r.name for r in _limit_reached(results)]
 
 
 def moveToPosHardLim(macro, motors_pos_dict):
-    try:
-        motors = list(motors_pos_dict.keys())
-        positions = list(motors_pos_dict.values())
-        # Checking positive limits state (maybe they were already active)
-        motorsOnPosLim = []
-        for m in motors:
-            if m.Limit_switches[1]:
-                macro.debug(
-                    'Motor %s is already at the positive limit.',
-                    m.alias())
-                motorsOnPosLim.append(m)
-        if len(motorsOnPosLim):
-            return motorsOnPosLim
-        macro.debug('Moving motors: %s towards positive limit...',
-                    repr([m.alias() for m in list(motors_pos_dict.keys())]))
-        for m, p in zip(motors, positions):
-            macro.debug('Moving motor %s to position: %f).', m.alias(), p)
-        motion = macro.getMotion(motors)
-        motion.move(positions)
-        macro.checkPoint()
-        # Checking stop code (if we reached positive limits)
-        motorsWhichReachedPosLim = []
-        for m in motors:
-            if m.StatusStopCode == 'Limit+ reached':
-                macro.debug('Motor %s reached its positive limit.', m.alias())
-                motorsWhichReachedPosLim.append(m)
-        return motorsWhichReachedPosLim
-    except PyTango.DevFailed as e:
-        macro.error(repr(e))
-        macro.error(
-            'Moving motors: %s to positive limits was interupted.',
-            repr(motors))
-        raise e
+    info_list = [(m, p, 1) for m, p in motors_pos_dict.items()]
+    results = homeToHardLim(macro, [info_list], use_sign=False)
+    return [r.motor for r in _limit_reached(results)]
 
 
 def moveToNegHardLim(macro, motors_pos_dict):
-    try:
-        motors = list(motors_pos_dict.keys())
-        positions = list(motors_pos_dict.values())
-        # Checking negative limits state (maybe they were already active)
-        motorsOnNegLim = []
-        for m in motors:
-            # macro.output(type(m.getAttribute('StatusLim-')))
-            if m.Limit_Switches[2]:
-                macro.debug(
-                    'Motor %s is already at the negative limit.',
-                    m.alias())
-                motorsOnNegLim.append(m)
-        if len(motorsOnNegLim):
-            return motorsOnNegLim
-        macro.debug('Moving motors: %s towards negative limit...',
-                    repr([m.alias() for m in list(motors_pos_dict.keys())]))
-        for m, p in zip(motors, positions):
-            macro.debug('Moving motor %s to position: %f).', m.alias(), p)
-        macro.debug('Before getting motion object motion object.')
-        motion = macro.getMotion(motors)
-        macro.debug('After getting motion object motion object.')
-        macro.debug("Motion: %s, Positions: %s", motion, positions)
-        motion.move(positions)
-        macro.debug('After move command to motion object.')
-        macro.checkPoint()
-        # Checking stop code (if we reached negative limits)
-        motorsWhichReachedNegLim = []
-        for m in motors:
-            if m.StatusStopCode == 'Limit- reached':
-                macro.debug('Motor %s reached its negative limit.', m.alias())
-                motorsWhichReachedNegLim.append(m)
-        return motorsWhichReachedNegLim
-    except PyTango.DevFailed as e:
-        macro.error(repr(e))
-        macro.error(
-            'Moving motors: %s to negative limits was interupted.',
-            repr(motors))
-        raise e
+    info_list = [(m, p, -1) for m, p in motors_pos_dict.items()]
+    results = homeToHardLim(macro, [info_list], use_sign=False)
+    return [r.motor for r in _limit_reached(results)]
+
+
+def readPositions(motors, max_workers=None):
+    """Read the user position of the motors. The motors are grouped by
+    controller and the groups are read in parallel by a pool of workers,
+    with one request per motor all of them sent at the same time (see
+    read_motors_attributes).
+    :param motors: (list) pool motor objects
+    :param max_workers: (int) maximum number of controllers read at the same
+        time (None for all of them)
+
+    :return: (list) positions in the same order as the motors"""
+    if not motors:
+        return []
+    by_ctrl = collections.OrderedDict()
+    for i, mot in enumerate(motors):
+        by_ctrl.setdefault(mot.getControllerName(), []).append(i)
+    groups = list(by_ctrl.values())
+    positions = [None] * len(motors)
+    with ThreadPoolExecutor(max_workers or len(groups)) as executor:
+        values = executor.map(
+            lambda group: read_motors_attributes(
+                [motors[i] for i in group], ['Position']),
+            groups)
+        for group, group_values in zip(groups, values):
+            for i, value in zip(group, group_values):
+                positions[i] = value['Position']
+    return positions
 
 
 def moveToReadPos(macro, motors):
     """This function reads current user position of motors passed as an
     argument and move motors to these positions.
+
+    All the positions are read at the same time (see readPositions) so the
+    motion starts from a consistent snapshot of them.
     :param macro: macro object which calls this method
     :param motors: (list) motors to be moved
     """
-    positions = []
-    for mot in motors:
-        positions.append(mot.getPosition(force=True))
+    positions = readPositions(motors)
     macro.debug("Current read positions: %s",
                 repr(list(zip(motors, positions))))
     motion = macro.getMotion(motors)
@@ -0,0 +1,296 @@
+"""
+Sequence files used by the seq_run macro
+
+A sequence file is an ASCII file with one macro per line. Empty lines and
+lines starting with "#" are ignored, and a leading "%" (spock magic) is
+removed.
+
+Blocks of lines can be repeated with a loop, closed by an ``end`` line. The
+loop variable is replaced in the lines of the block where it appears as
+``$name`` or ``${name}``. The values are listed after ``in``, or generated
+with ``range <start> <stop> [<step>]`` (the stop value is excluded, as in
+python). Loops can be nested::
+
+    for sample in 1 2 3
+        mv sample_x ${sample}0
+        for energy in range 7000 7100 25
+            mv energy $energy
+            ascanct mot14 0 10 10 0.1
+        end
+    end
+
+Loops are expanded when the file is read, so every macro of the expanded
+sequence is validated, timed and checkpointed as a line of its own.
+
+Consecutive moves of the same kind (``mv``, ``umv``, ``mvr`` or ``umvr``) of
+different motors can be fused in a single macro which moves all of them at
+the same time (see `fuse_lines`).
+
+The whole file is parsed before running anything, and the progress is stored
+in a checkpoint file next to it (``<sequence file>.checkpoint``). An
+interrupted sequence can be resumed from the first line which did not
+finish, as long as the file did not change in the meantime.
+
+Every run writes a timing log next to the sequence file
+(``<sequence file>.timing_<YYYYmmdd_HHMMSS>.csv``) with the start and end
+time, the wall time and the error status of each executed line.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import string
+import time
+
+__all__ = ['SequenceLine', 'read_sequence', 'fuse_lines',
+           'SequenceCheckpoint', 'SequenceTimingLog']
+
+#: macros whose consecutive lines can be fused in a single macro
+FUSABLE_MACROS = ('mv', 'umv', 'mvr', 'umvr')
+
+
+class SequenceLine(object):
+    """One macro of a sequence file"""
+
+    def __init__(self, line_number, text):
+        #: line number in the file (starting at 1)
+        self.line_number = line_number
+        #: macro line as written in the file
+        self.text = text
+        #: macro name and parameters (filled in by the validation)
+        self.macro = None
+
+    @property
+    def macro_name(self):
+        return self.text.split()[0]
+
+    @property
+    def params_str(self):
+        parts = self.text.split(None, 1)
+        return parts[1] if len(parts) > 1 else ''
+
+    def __repr__(self):
+        return 'Line {0:3d}: {1}'.format(self.line_number, self.text)
+
+
+def _range_values(line_number, args):
+    """Values of a "range <start> <stop> [<step>]" loop as strings"""
+    try:
+        numbers = [int(v) for v in args]
+    except ValueError:
+        try:
+            numbers = [float(v) for v in args]
+        except ValueError:
+            numbers = []
+    if len(args) not in (2, 3) or len(numbers) != len(args):
+        raise ValueError('Line {0}: the range must be "range <start> <stop> '
+                         '[<step>]"'.format(line_number))
+    start, stop = numbers[:2]
+    step = numbers[2] if len(numbers) == 3 else 1
+    if step == 0:
+        raise ValueError('Line {0}: the range step can not be '
+                         '0'.format(line_number))
+    # compute every value from the start to not accumulate rounding errors
+    nb_values = max(0, int(-((start - stop) // step)))
+    return [repr(round(start + i * step, 12)) for i in range(nb_values)]
+
+
+def _parse_for(line_number, words):
+    """Loop variable and values of a "for <name> in <values>" line"""
+    if len(words) < 4 or words[2] != 'in' or \
+            not words[1].isidentifier():
+        raise ValueError('Line {0}: the loop must be "for <name> in '
+                         '<values>"'.format(line_number))
+    values = words[3:]
+    if values[0] == 'range':
+        values = _range_values(line_number, values[1:])
+    if not values:
+        raise ValueError('Line {0}: the loop has no values'.format(
+            line_number))
+    return words[1], values
+
+
+def _expand(items, start, variables, lines, nested=False):
+    """Expand the lines from start until the end of the file or, if nested,
+    until the "end" of the current loop.
+
+    :return: (int) index of the item after the expanded block"""
+    i = start
+    while i < len(items):
+        ln, text = items[i]
+        text = string.Template(text).safe_substitute(variables)
+        words = text.split()
+        if words[0] == 'end':
+            if not nested:
+                raise ValueError('Line {0}: "end" without "for"'.format(ln))
+            return i + 1
+        if words[0] == 'for':
+            name, values = _parse_for(ln, words)
+            for value in values:
+                block_variables = dict(variables)
+                block_variables[name] = value
+                block_end = _expand(items, i + 1, block_variables, lines,
+                                    nested=True)
+            i = block_end
+            continue
+        lines.append(SequenceLine(ln, text))
+        i += 1
+    if nested:
+        raise ValueError('Line {0}: "for" without "end"'.format(
+            items[start - 1][0]))
+    return i
+
+
+def read_sequence(filename):
+    """Read a sequence file and expand its loops.
+
+    :param filename: (str) absolute path of the sequence file
+
+    :return: (tuple<list<SequenceLine>, str>) the macro lines and the
+        digest of the file content"""
+    with open(filename, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha1(content).hexdigest()
+    items = []
+    for ln, line in enumerate(content.decode().splitlines(), 1):
+        line = line.strip()
+        if len(line) == 0 or line[0] == '#':
+            continue
+        if line[0] == '%':
+            line = line[1:].strip()
+            if len(line) == 0:
+                continue
+        items.append((ln, line))
+    lines = []
+    _expand(items, 0, {}, lines)
+    return lines, digest
+
+
+def fuse_lines(lines):
+    """Fuse consecutive moves of the same kind (see FUSABLE_MACROS) in a
+    single macro, as long as every motor appears only once. The motors of a
+    fused line move at the same time instead of one after the other.
+
+    :param lines: (list<SequenceLine>) validated lines (with their macro)
+
+    :return: (list<SequenceLine>) the fused lines. A fused line has the line
+        number of its first line."""
+    fused = []
+    for line in lines:
+        prev = fused[-1] if fused else None
+        if prev is not None and line.macro_name in FUSABLE_MACROS \
+                and line.macro_name == prev.macro_name:
+            prev_motors = set(m.lower() for m, _ in prev.macro[1])
+            motors = set(m.lower() for m, _ in line.macro[1])
+            if not prev_motors & motors:
+                pairs = prev.macro[1] + line.macro[1]
+                text = ' '.join([line.macro_name] +
+                                [' '.join(pair) for pair in pairs])
+                prev = SequenceLine(prev.line_number, text)
+                prev.macro = [line.macro_name, pairs]
+                fused[-1] = prev
+                continue
+        fused.append(line)
+    return fused
+
+
+class SequenceCheckpoint(object):
+    """Progress of a sequence stored next to the sequence file"""
+
+    def __init__(self, filename, digest):
+        self.filename = filename + '.checkpoint'
+        self.digest = digest
+        #: index of the next line to execute in the expanded sequence
+        self.next_step = 0
+
+    def load(self):
+        """Load the checkpoint of a previous run.
+
+        :return: (bool) True if there was a checkpoint for the same
+            sequence file content"""
+        if not os.path.exists(self.filename):
+            return False
+        with open(self.filename, 'r') as f:
+            data = json.load(f)
+        if data.get('digest') != self.digest:
+            return False
+        self.next_step = data['next_step']
+        return True
+
+    def save(self, next_step):
+        """Store the progress. The file is replaced atomically so a crash
+        never leaves a corrupted checkpoint.
+
+        :param next_step: (int) index of the next line to execute in the
+            expanded sequence"""
+        self.next_step = next_step
+        data = {'digest': self.digest, 'next_step': self.next_step}
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_filename, self.filename)
+
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+class SequenceTimingLog(object):
+    """Timing log of a sequence run. Each executed line is appended to the
+    CSV file as soon as it finishes."""
+
+    FIELDS = ('line', 'macro', 'start', 'end', 'elapsed', 'status', 'error')
+
+    def __init__(self, filename):
+        self.start = time.time()
+        self.filename = '{0}.timing_{1}.csv'.format(
+            filename, time.strftime('%Y%m%d_%H%M%S',
+                                    time.localtime(self.start)))
+        self.records = []
+        with open(self.filename, 'w', newline='') as f:
+            csv.writer(f).writerow(self.FIELDS)
+
+    @staticmethod
+    def _timestamp(t):
+        return '{0}.{1:03d}'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t)),
+            int(t % 1 * 1000))
+
+    def add(self, line, start, end, error=None):
+        """Record an executed line.
+
+        :param line: (SequenceLine) the executed line
+        :param start: (float) start time (time.time())
+        :param end: (float) end time (time.time())
+        :param error: (Exception) the error raised by the macro, if any"""
+        record = {'line': line.line_number, 'macro': line.text,
+                  'start': start, 'end': end, 'elapsed': end - start,
+                  'status': 'ok' if error is None else 'error',
+                  'error': '' if error is None else str(error)}
+        self.records.append(record)
+        row = dict(record, start=self._timestamp(start),
+                   end=self._timestamp(end),
+                   elapsed='{0:.3f}'.format(end - start))
+        with open(self.filename, 'a', newline='') as f:
+            csv.DictWriter(f, self.FIELDS).writerow(row)
+
+    def summary(self, nb_slowest=5):
+        """Return the summary of the run as a list of text lines: total,
+        macro and overhead (time between macros) times and the slowest
+        lines."""
+        end = time.time()
+        macros = sum(r['elapsed'] for r in self.records)
+        total = end - self.start
+        text = ['Total time: {0:.3f} s for {1} line(s)'.format(
+                    total, len(self.records)),
+                'Time in macros: {0:.3f} s'.format(macros),
+                'Overhead between macros: {0:.3f} s'.format(total - macros)]
+        slowest = sorted(self.records, key=lambda r: r['elapsed'],
+                         reverse=True)[:nb_slowest]
+        if slowest:
+            text.append('Slowest lines:')
+        for r in slowest:
+            text.append('  Line {0:3d}: {1:10.3f} s  {2}'.format(
+                r['line'], r['elapsed'], r['macro']))
+        return text
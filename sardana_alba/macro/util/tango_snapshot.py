@@ -0,0 +1,118 @@
+"""
+Snapshot of the Tango database topology shared by the macros of a
+MacroServer
+
+The servers, devices and starters are read from the Tango database (with
+tangoctl) the first time they are needed and kept for ``ttl`` seconds, so
+browsing them does not query the database on every macro. Only this
+topology is kept: the servers run by the starters and their states are
+asked to the starters every time. The server
+filters (fnmatch expressions, e.g. ``TangoTest/*``) are compiled once into a
+single regular expression.
+
+Example::
+
+    from sardana_alba.macro.util.tango_snapshot import get_snapshot, \\
+        compile_patterns
+
+    snapshot = get_snapshot(ttl=60)
+    match = compile_patterns(('TangoTest/*',))
+    servers = [s for s in snapshot.db_info.servers.values()
+               if match(s.name)]
+"""
+
+import fnmatch
+import functools
+import re
+import threading
+import time
+
+import tangoctl
+
+__all__ = ['TangoSnapshot', 'get_snapshot', 'compile_patterns']
+
+#: default time in seconds before reading the database again
+SNAPSHOT_TTL = 60
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(patterns):
+    regex = '|'.join('(?:{0})'.format(fnmatch.translate(p))
+                     for p in patterns)
+    return re.compile(regex).match
+
+
+def compile_patterns(patterns):
+    """Return a function which tells if a name matches any of the fnmatch
+    patterns (all names match if there are no patterns).
+
+    :param patterns: (seq<str> or str) fnmatch patterns, or None"""
+    if not patterns:
+        return lambda name: True
+    if isinstance(patterns, str):
+        patterns = (patterns,)
+    match = _compile(tuple(patterns))
+    return lambda name: match(name) is not None
+
+
+class TangoSnapshot(object):
+    """Servers, devices and starters of the Tango database"""
+
+    def __init__(self, ttl=SNAPSHOT_TTL):
+        self.ttl = ttl
+        self.db = tangoctl.get_db()
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Forget the snapshot, it is read again when it is needed"""
+        with self._lock:
+            self._db_info = None
+            self._db_info_time = None
+            self._starters = None
+            self._starters_time = None
+
+    def _expired(self, t):
+        return t is None or time.monotonic() - t > self.ttl
+
+    @property
+    def age(self):
+        """Time since the servers were read, None if not read yet"""
+        if self._db_info_time is None:
+            return None
+        return time.monotonic() - self._db_info_time
+
+    @property
+    def db_info(self):
+        """tangoctl.DatabaseInfo with the servers and devices"""
+        with self._lock:
+            if self._expired(self._db_info_time):
+                self._db_info = tangoctl.get_db_info(db=self.db)
+                self._db_info_time = time.monotonic()
+            return self._db_info
+
+    @property
+    def starters(self):
+        """Dictionary of tangoctl.Starter and their servers (None if the
+        starter does not answer). The servers and their states are read from
+        the starters on every call."""
+        with self._lock:
+            if self._expired(self._starters_time):
+                self._starters = list(tangoctl.iter_starters(db=self.db))
+                self._starters_time = time.monotonic()
+            starters = self._starters
+        return tangoctl.starters_servers(*starters)
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot(ttl=SNAPSHOT_TTL):
+    """Return the snapshot of the MacroServer, creating it the first time"""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = TangoSnapshot(ttl)
+        _snapshot.ttl = ttl
+    return _snapshot
@@ -1,13 +1,93 @@
 from sardana.macroserver.macro import Macro, Type
+import json
+import os
+import time
 import PyTango
 
 
+class XBPMJournal(object):
+    """
+    Progress of an XBPM calibration: one JSON line per completed mesh with
+    its gap, phase and scan id. The first line has the settings of the
+    calibration and the ID configuration before the first run, the journal
+    of a calibration with other settings is not used.
+    """
+
+    def __init__(self, filename, settings):
+        self.filename = filename
+        self.settings = settings
+        self.done = {}
+        #: ID gap and phase before the first run (dict or None)
+        self.id_config = None
+
+    @staticmethod
+    def _key(scan_value, phase_value):
+        return round(float(scan_value), 6), round(float(phase_value), 6)
+
+    def _append(self, data):
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(data) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self, id_config=None):
+        """Load the completed points and the ID configuration of a previous
+        run, or start a new journal with the given ID configuration.
+
+        :param id_config: (dict) current ID gap and phase
+        :return: (bool) True if there was a journal with the same settings"""
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as f:
+                records = [json.loads(line) for line in f if line.strip()]
+            if records and records[0].get('settings') == self.settings:
+                self.id_config = records[0].get('id_config')
+                for record in records[1:]:
+                    key = self._key(record['gap'], record['phase'])
+                    self.done[key] = record['scan_id']
+                return True
+        self.archive()
+        self.id_config = id_config
+        self._append({'settings': self.settings, 'id_config': id_config})
+        return False
+
+    def is_done(self, scan_value, phase_value):
+        return self._key(scan_value, phase_value) in self.done
+
+    def add(self, scan_value, phase_value, scan_id):
+        key = self._key(scan_value, phase_value)
+        self.done[key] = scan_id
+        self._append({'gap': key[0], 'phase': key[1], 'scan_id': scan_id,
+                      'time': time.time()})
+
+    def archive(self):
+        """Rename the journal adding the date, so it is kept as a record of
+        the scan ids but not used by the next calibration."""
+        if os.path.exists(self.filename):
+            name, ext = os.path.splitext(self.filename)
+            os.replace(self.filename, '{0}_{1}{2}'.format(
+                name, time.strftime('%Y%m%d_%H%M%S'), ext))
+
+
 class XBPMspectra(Macro):
     """
     Macro to execute a sequence of scans to calibrate the XBPM of the beamlines
+
+    The ID gap and phase move together, and the XBPM motors go back to 0 in
+    the same motion which moves the ID to the next point. With continuous,
+    the meshes are done with meshct instead of mesh.
+
+    Every completed mesh is recorded with its scan id in the journal
+    xbpm_progress.jsonl of the scan directory. Running the macro again with
+    the same settings skips the completed meshes (use restart to run all of
+    them again). When the calibration finishes the journal is renamed to
+    xbpm_progress_<date>.jsonl.
     """
 
     param_def = [['firstValue', Type.Float, 0, 'Value'],
+                 ['continuous', Type.Boolean, False, 'Use continuous '
+                                                     'meshes (meshct)'],
+                 ['restart', Type.Boolean, False, 'Do not skip the meshes '
+                                                  'of a previous run'],
                  ]
 
     def prepare(self, *args):
@@ -55,47 +135,96 @@ class XBPMspectra(Macro):
                 self.phase_values = [0]
                 self.bck_id_phase = 0
 
-    def _loadIDConfig(self):
-        if not self.bck_id_gap:
-            self._moveID(self.bck_id_gap, self.bck_id_phase)
+    def _loadIDConfig(self, xbpm_home=False):
+        """Move the ID back to the saved gap and phase (and the XBPM motors
+        to 0 if xbpm_home) in a single motion."""
+        if self.mag_field:
+            # Implement the way to load the value in BL04
+            if xbpm_home:
+                self._moveXBPMHome()
+            return
+        if self.bck_id_gap is not None:
+            self._moveID(self.bck_id_gap, self.bck_id_phase, xbpm_home)
         else:
             self.error('bck_id_gap is None. The saveIDConfig did not work')
+            if xbpm_home:
+                self._moveXBPMHome()
 
-    def _moveID(self, scan_value, phase_value):
+    def _moveID(self, scan_value, phase_value, xbpm_home=False):
+        """Move the ID gap and phase (and the XBPM motors to 0 if xbpm_home)
+        in a single motion."""
+        motors = []
         if self.mag_field:
             # Implement the way to save the value in BL04
             pass
         else:
             # Implement the way to save the value in other beamlines
-            self.execMacro('mv %s %f' % (self.scan_motor, scan_value))
+            motors.append((self.scan_motor, scan_value))
             if self.phase_motor != 'None':
-                self.execMacro('mv %s %f' % (self.phase_motor, phase_value))
+                motors.append((self.phase_motor, phase_value))
+        if xbpm_home:
+            motors += [(self.xbpm_h, 0), (self.xbpm_v, 0)]
+        if motors:
+            self.execMacro(['mv', [[name, str(value)]
+                                   for name, value in motors]])
+
+    def _moveXBPMHome(self):
+        self.execMacro('mv %s 0 %s 0' % (self.xbpm_h, self.xbpm_v))
 
-    def run(self, firstValue):
+    def run(self, firstValue, continuous, restart):
         bck_scan_file = self.getEnv('ScanFile')
         bck_scan_dir = self.getEnv('ScanDir')
         bck_mg = self.getEnv('ActiveMntGrp')
         self.setEnv('ScanFile', self.scan_file)
         self.setEnv('ScanDir', self.scan_dir)
         self.setEnv('ActiveMntGrp', self.mg)
+        mesh_name = 'mesh'
+        if continuous:
+            mesh_name = 'meshct'
+        xbpm_home = False
+        settings = {'scan_motor': self.scan_motor,
+                    'phase_motor': self.phase_motor,
+                    'scan_range': [float(v) for v in self.scan_range],
+                    'scan_steps': int(self.scan_steps),
+                    'scan_itime': float(self.scan_itime),
+                    'mesh': mesh_name}
+        journal = XBPMJournal(os.path.join(self.scan_dir,
+                                           'xbpm_progress.jsonl'), settings)
+        if restart:
+            journal.archive()
         try:
             self._saveIDConfig()
+            id_config = None
+            if self.bck_id_gap is not None:
+                id_config = {'gap': float(self.bck_id_gap),
+                             'phase': float(self.bck_id_phase)}
+            if journal.load(id_config):
+                self.info('Skipping the %d meshes done in a previous run' %
+                          len(journal.done))
+                if journal.id_config is not None:
+                    # restore the ID as it was before the first run
+                    self.bck_id_gap = journal.id_config['gap']
+                    self.bck_id_phase = journal.id_config['phase']
             for scan_value in self.scan_values:
                 if scan_value >= firstValue:
                     for phase_value in self.phase_values:
-                        self._moveID(scan_value, phase_value)
-                        mesh_macro = ('mesh %s %f %f %d %s %f %f %d %f' %
-                                      (self.xbpm_h, self.scan_range[0],
+                        if journal.is_done(scan_value, phase_value):
+                            continue
+                        # the XBPM motors go back to 0 while the ID moves
+                        self._moveID(scan_value, phase_value, xbpm_home)
+                        mesh_macro = ('%s %s %f %f %d %s %f %f %d %f' %
+                                      (mesh_name, self.xbpm_h,
+                                       self.scan_range[0],
                                        self.scan_range[1], self.scan_steps,
                                        self.xbpm_v, self.scan_range[0],
                                        self.scan_range[1], self.scan_steps,
                                        self.scan_itime))
 
+                        xbpm_home = True
                         self.execMacro(mesh_macro)
-                        # TODO: Verified if it's possible to move both motor
-                        # together
-                        self.execMacro('mv %s 0 %s 0' % (self.xbpm_h,
-                                                         self.xbpm_v))
+                        journal.add(scan_value, phase_value,
+                                    self.getEnv('ScanID'))
+            journal.archive()
         except Exception as e:
             self.error('Error with the scan %s' % str(e))
 
@@ -103,4 +232,5 @@ class XBPMspectra(Macro):
             self.setEnv('ScanFile', bck_scan_file)
             self.setEnv('ScanDir', bck_scan_dir)
             self.setEnv('ActiveMntGrp', bck_mg)
-            self._loadIDConfig()
+            # also if a mesh failed or was aborted
+            self._loadIDConfig(xbpm_home)
@@ -12,6 +12,6 @@ setup(
     url="http://github.com/ALBA-Synchrotron/sardana-alba",
     packages=find_packages(),
     install_requires=["sardana"],
-    extras_require={'admin': ['tangoctl >= 0.6.0']},
+    extras_require={'admin': ['tangoctl >= 0.10.0']},
     python_requires=">=3.5",
 )
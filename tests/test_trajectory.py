@@ -0,0 +1,183 @@
+"""
+Checks of the batch trajectory API of the pseudo motor controllers
+(sardana_alba.ctrl.util.trajectory) against their scalar methods.
+"""
+
+import numpy
+import pytest
+
+from sardana_alba.ctrl.AlbaBlCommonDirectionSlitPseudomotor import \
+    CommonDirectionSlit
+from sardana_alba.ctrl.AlbaBlTwoLeggedTablePseudomotor import \
+    TwoLeggedTableController
+from sardana_alba.ctrl.AlbaBlTwoXStagePseudomotor import TwoXStageController
+from sardana_alba.ctrl.AlbaBlTripodTablePseudomotor import \
+    TripodTableController
+from sardana_alba.ctrl.MoveableMaskPseudomotor import MoveableMask
+from sardana_alba.ctrl.TwoCoupledPseudoMotor import TwoCoupledPseudoMotor
+
+#: finite difference step of the reference Jacobians
+STEP = 1e-6
+
+TRIPOD_PROPS = {'Jack1Coordinates': '0, 0, 1400',
+                'Jack2Coordinates': '1000, 500, 1400',
+                'Jack3Coordinates': '1000, -500, 1400',
+                'CenterCoordinates': '500, 0, 1500',
+                'CrossedPMLimitsCheck': False}
+
+
+def make_mask():
+    mask = MoveableMask('mask', {})
+    mask.aperture_origin = 1.0
+    mask.offset_origin = -0.5
+    return mask
+
+
+# controller factory, pseudo positions, physical positions and tolerance of
+# the pseudo -> physical -> pseudo round trip
+CASES = {
+    'slit': (lambda: CommonDirectionSlit('slit', {'sign': -1.0}),
+             [[2.0, 0.5], [0.1, -1.0], [5.0, 3.0]],
+             [[1.0, -1.0], [2.5, 0.3], [-0.2, -1.4]], 1e-12),
+    'two_legged': (lambda: TwoLeggedTableController(
+                       'table', {'dist1': -500.0, 'dist2': 700.0}),
+                   [[0.0, 0.0], [1.5, 2.0], [-3.0, -5.0]],
+                   [[0.0, 0.0], [1.0, 2.0], [-2.0, 1.5]], 1e-9),
+    'mask': (make_mask,
+             [[2.0, 0.5], [0.1, -1.0], [5.0, 3.0]],
+             [[1.0, -1.0], [2.5, 0.3], [-0.2, -1.4]], 1e-12),
+    'two_x': (lambda: TwoXStageController(
+                  'stage', {'Tx1Coordinates': '-711.9, -300',
+                            'Tx2Coordinates': '689, 400', 'Dx': '0'}),
+              [[0.0, 0.0], [1.5, 2.0], [-3.0, -5.0]],
+              [[0.0, 0.0], [1.0, 2.0], [-2.0, 1.5]], 1e-9),
+    # the closed-form inverse of the tripod is not exact for combined pitch
+    # and roll
+    'tripod': (lambda: TripodTableController('tripod', dict(TRIPOD_PROPS)),
+               [[0.0, 0.0, 0.0], [1.0, 2.0, -3.0], [-2.0, 0.5, 1.5]],
+               [[0.0, 0.0, 0.0], [1.0, 2.0, -1.0], [-0.5, 0.3, 0.8]], 1e-4),
+    'two_coupled': (lambda: TwoCoupledPseudoMotor('coupled',
+                                                  {'tolerance': -1}),
+                    [[1.0], [-2.5], [0.0]],
+                    [[1.0, 1.0], [-2.5, -2.5], [0.3, 0.7]], 1e-12),
+}
+
+
+@pytest.fixture(params=sorted(CASES))
+def case(request):
+    factory, pseudos, physicals, tolerance = CASES[request.param]
+    return (factory(), numpy.array(pseudos), numpy.array(physicals),
+            tolerance)
+
+
+def scalar_physicals(ctrl, pseudo):
+    curr = [0.0] * len(ctrl.motor_roles)
+    return numpy.array([ctrl.CalcPhysical(i + 1, list(pseudo), curr)
+                        for i in range(len(ctrl.motor_roles))])
+
+
+def scalar_pseudos(ctrl, physical):
+    curr = [0.0] * len(ctrl.pseudo_motor_roles)
+    return numpy.array([ctrl.CalcPseudo(i + 1, list(physical), curr)
+                        for i in range(len(ctrl.pseudo_motor_roles))])
+
+
+def scalar_jacobian(func, point):
+    """Central difference Jacobian of a scalar conversion"""
+    columns = []
+    for axis in range(len(point)):
+        delta = numpy.zeros(len(point))
+        delta[axis] = STEP
+        columns.append((func(point + delta) - func(point - delta)) /
+                       (2 * STEP))
+    return numpy.column_stack(columns)
+
+
+def test_physical_batch_matches_scalar(case):
+    ctrl, pseudos, _, _ = case
+    expected = [scalar_physicals(ctrl, p) for p in pseudos]
+    numpy.testing.assert_allclose(ctrl.CalcAllPhysicalBatch(pseudos),
+                                  expected, rtol=1e-12, atol=1e-12)
+    numpy.testing.assert_allclose(ctrl.CalcAllPhysicalBatch(pseudos[1]),
+                                  expected[1], rtol=1e-12, atol=1e-12)
+
+
+def test_pseudo_batch_matches_scalar(case):
+    ctrl, _, physicals, _ = case
+    expected = [scalar_pseudos(ctrl, p) for p in physicals]
+    numpy.testing.assert_allclose(ctrl.CalcAllPseudoBatch(physicals),
+                                  expected, rtol=1e-12, atol=1e-12)
+    numpy.testing.assert_allclose(ctrl.CalcAllPseudoBatch(physicals[1]),
+                                  expected[1], rtol=1e-12, atol=1e-12)
+
+
+def test_round_trip(case):
+    ctrl, pseudos, _, tolerance = case
+    physicals = ctrl.CalcAllPhysicalBatch(pseudos)
+    numpy.testing.assert_allclose(ctrl.CalcAllPseudoBatch(physicals),
+                                  pseudos, rtol=0, atol=tolerance)
+
+
+def test_physical_jacobian_matches_scalar(case):
+    ctrl, pseudos, _, _ = case
+    jacobians = ctrl.CalcPhysicalJacobianBatch(pseudos)
+    for pseudo, jacobian in zip(pseudos, jacobians):
+        expected = scalar_jacobian(lambda p: scalar_physicals(ctrl, p),
+                                   pseudo)
+        numpy.testing.assert_allclose(jacobian, expected, rtol=1e-6,
+                                      atol=1e-6)
+
+
+def test_pseudo_jacobian_matches_scalar(case):
+    ctrl, _, physicals, _ = case
+    jacobians = ctrl.CalcPseudoJacobianBatch(physicals)
+    for physical, jacobian in zip(physicals, jacobians):
+        expected = scalar_jacobian(lambda p: scalar_pseudos(ctrl, p),
+                                   physical)
+        numpy.testing.assert_allclose(jacobian, expected, rtol=1e-6,
+                                      atol=1e-6)
+
+
+def test_physical_velocity_matches_positions(case):
+    ctrl, pseudos, _, _ = case
+    velocities = numpy.linspace(0.5, 1.5, pseudos.shape[1])
+    expected = [(scalar_physicals(ctrl, p + STEP * velocities) -
+                 scalar_physicals(ctrl, p - STEP * velocities)) / (2 * STEP)
+                for p in pseudos]
+    numpy.testing.assert_allclose(
+        ctrl.CalcPhysicalVelocityBatch(pseudos, velocities), expected,
+        rtol=1e-6, atol=1e-6)
+
+
+@pytest.mark.parametrize('pseudo', [[1.0, 0.0, 0.0], [0.0, 2.0, 0.0],
+                                    [0.0, 0.0, -3.0], [-1.0, 1.0, 0.0]])
+def test_tripod_numerical_inverse_matches_analytic(pseudo):
+    # without roll the closed-form inverse is exact
+    ctrl = TripodTableController('tripod', dict(TRIPOD_PROPS))
+    numpy.testing.assert_allclose(ctrl.CalcAllPhysicalNumerical(pseudo),
+                                  ctrl.CalcAllPhysical(pseudo, []),
+                                  rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize('pseudo', [[1.0, 2.0, -3.0], [-2.0, 0.5, 1.5]])
+def test_tripod_numerical_inverse_refines_analytic(pseudo):
+    ctrl = TripodTableController('tripod', dict(TRIPOD_PROPS))
+    analytic = ctrl.CalcAllPhysical(pseudo, [])
+    numerical = ctrl.CalcAllPhysicalNumerical(pseudo, analytic)
+    numpy.testing.assert_allclose(numerical, analytic, rtol=0, atol=1e-4)
+    numpy.testing.assert_allclose(ctrl.CalcAllPseudo(numerical, []), pseudo,
+                                  rtol=0, atol=1e-9)
+
+    props = dict(TRIPOD_PROPS, NumericalInverse=True)
+    refined = TripodTableController('tripod', props)
+    numpy.testing.assert_allclose(refined.CalcAllPhysical(pseudo, []),
+                                  numerical, rtol=0, atol=1e-9)
+
+
+def test_numerical_inverse_starts_from_current_positions():
+    # redundant controller: the slave keeps its current position
+    ctrl = TwoCoupledPseudoMotor('coupled', {'tolerance': -1})
+    numpy.testing.assert_allclose(
+        ctrl.CalcAllPhysicalNumerical([1.0], [0.5, 3.0]), [1.0, 3.0])
+    numpy.testing.assert_allclose(
+        ctrl.CalcAllPhysicalNumerical([1.0], [1.0, 7.0]), [1.0, 7.0])